@@ -20,8 +20,10 @@ __version__ = '0.15.1'
 from .composer import composer as _composer
 from .composer import ComposerError, serialize, Composition, get_value, get_params, set_params
 from .composer import retain_result, retain_nested_result, dec_count, set_nested_params, get_nested_params
-from .composer import set_nested_result, get_nested_result, retry_cond
-from .composer import parse_action_name
+from .composer import set_nested_result, get_nested_result, retry_cond, merge_results
+from .composer import reduce_cond, reduce_groups, reduce_results, reduce_round, reduce_pending, reduce_group, reduce_collect
+from .composer import reduce_folded, reduce_result
+from .composer import parse_action_name, inline_compositions
 
 # statically export composer combinators to avoid E1101 pylint errors
 
@@ -100,3 +102,36 @@ def asynchronous(*arguments):
 
 def merge(*arguments):
     return _composer.merge(*arguments)
+
+def map(*arguments):
+    return _composer.map(*arguments)
+
+def parallel(*arguments):
+    return _composer.parallel(*arguments)
+
+def parallel_merge(*arguments):
+    return _composer.parallel_merge(*arguments)
+
+def race(*arguments, stagger=0, winner=None):
+    return _composer.race(stagger, winner, *arguments)
+
+def reduce(reducer, arity=2):
+    return _composer.reduce(reducer, arity)
+
+def cpu_map(function, chunk=1000):
+    return _composer.cpu_map(function, chunk)
+
+def memo(body, key=None, ttl=None, max_entries=1000, cache_errors=False):
+    return _composer.memo(body, { 'key': key, 'ttl': ttl, 'max_entries': max_entries, 'cache_errors': cache_errors })
+
+def breaker(body, failures=5, window=60, cooldown=30, fallback=None):
+    return _composer.breaker(body, { 'failures': failures, 'window': window, 'cooldown': cooldown }, fallback)
+
+def timeout(ms, body, fallback=None):
+    return _composer.timeout(ms, body, fallback)
+
+def batch(name, size=100):
+    return _composer.batch(name, size)
+
+def project(fields, body):
+    return _composer.project(fields, body)
@@ -24,6 +24,7 @@ import base64
 import marshal
 import types
 import copy
+import hashlib
 
 from composer import __version__
 
@@ -74,6 +75,44 @@ def retry_cond(env, args):
     env['count'] -= 1
     return 'error' in result and count > 0
 
+def merge_results(env, args):
+    merged = {}
+    for result in args['value']:
+        merged.update(result)
+    return merged
+
+def reduce_cond(env, args):
+    return len(args['value']) > 1
+
+def reduce_groups(env, args):
+    return { 'value': [args['value'][i:i + env['arity']] for i in range(0, len(args['value']), env['arity'])] }
+
+def reduce_results(env, args):
+    return { 'value': [result['value'] for result in args['value']] }
+
+def reduce_round(env, args):
+    env['groups'] = [args['value'][i:i + env['arity']] for i in range(0, len(args['value']), env['arity'])]
+    env['index'] = 0
+    env['results'] = []
+
+def reduce_pending(env, args):
+    return env['index'] < len(env['groups'])
+
+def reduce_group(env, args):
+    env['index'] += 1
+    return { 'value': env['groups'][env['index'] - 1] }
+
+def reduce_collect(env, args):
+    env['results'].append(args['value'])
+
+def reduce_folded(env, args):
+    return { 'value': env['results'] }
+
+def reduce_result(env, args):
+    if len(args['value']) == 0:
+        return { 'error': 'Reduce combinator expects a non-empty array' }
+    return { 'value': args['value'][0] }
+
 # lowerer
 
 lowerer = types.SimpleNamespace()
@@ -157,6 +196,33 @@ def retry(count, *components):
 def merge (*components):
     return composer.seq(composer.retain(*components), lambda env, args: args['params'].update(args['result']))
 
+@loweropt
+def reduce(reducer, arity):
+    if arity < 2:
+        raise ComposerError('Invalid argument "arity" in "reduce combinator"', arity)
+    if reducer.type == 'function':
+        # a function reducer costs no activation, fold the groups of each round in turn within the conductor,
+        # index is the next group to fold so that the groups are left unchanged
+        return composer.let(
+            { 'arity': arity, 'groups': None, 'index': None, 'results': None },
+            composer.loop(
+                reduce_cond,
+                composer.seq(
+                    reduce_round,
+                    composer.loop_nosave(reduce_pending, composer.seq(reduce_group, composer.mask(reducer), reduce_collect)),
+                    reduce_folded)),
+            reduce_result)
+    return composer.let(
+        { 'arity': arity },
+        composer.loop(
+            reduce_cond,
+            composer.seq(reduce_groups, composer.map(composer.mask(reducer)), reduce_results)),
+        reduce_result)
+
+@loweropt
+def parallel_merge(*components):
+    return composer.seq(composer.parallel(*components), merge_results)
+
 # == Done lowerer
 
 def visit(composition, f):
@@ -195,6 +261,75 @@ def label(composition):
 
     return label('')(composition)
 
+def fuse_actions(composition, actions):
+    '''
+        recursively replace runs of consecutive action combinators executed one after the other by
+        native sequences, appending the definitions of the sequences to actions; an action failing
+        in a sequence fails the sequence so errors are handled exactly as before
+    '''
+    def fuser(composition, _=None):
+        composition = visit(composition, fuser)
+        if composition.type not in ('sequence', 'let', 'mask', 'asynchronous', 'map'):
+            return composition # components of parallel and race are not executed one after the other
+
+        components = []
+        run = []
+
+        def close():
+            if len(run) > 1:
+                names = [action.name for action in run]
+                digest = hashlib.sha256(json.dumps(names).encode()).hexdigest()[:16]
+                sequence = composer.action('/_/composer-sequence-'+digest, { 'sequence': names })
+                if all(action['name'] != sequence.name for action in actions):
+                    actions.append({ 'name': sequence.name, 'action': sequence.action })
+                del sequence.action
+                sequence.path = run[0].path
+                components.append(sequence)
+            else:
+                components.extend(run)
+            del run[:]
+
+        for component in composition.components:
+            if component.type == 'action' and not hasattr(component, 'inline'):
+                if len(run) == 50: # default maximum length of an OpenWhisk sequence
+                    close()
+                run.append(component)
+            else:
+                close()
+                components.append(component)
+        close()
+        composition.components = components
+        return composition
+
+    return fuser(composition)
+
+def inline_compositions(composition, resolve):
+    '''
+        recursively replace the composition combinators naming a deployed composition by this composition,
+        resolve maps a name to the AST of the composition deployed under this name or None for other actions;
+        an inlined composition runs under masks hiding the variables declared around the combinator, and
+        compositions referencing themselves are still invoked
+    '''
+    def inliner(visible, active):
+        def inline(composition, _=None):
+            if composition.type == 'composition' and composition.name not in active:
+                ast = resolve(composition.name)
+                if ast is None:
+                    return composition
+                body = inliner(0, active + (composition.name,))(ast.compile()['composition'])
+                for _ in range(visible):
+                    body = composer.mask(body)
+                body.path = composition.path
+                return body
+            if composition.type == 'let':
+                return visit(composition, inliner(visible + 1, active))
+            if composition.type == 'mask':
+                return visit(composition, inliner(max(visible - 1, 0), active))
+            return visit(composition, inliner(visible, active))
+        return inline
+
+    return inliner(0, ())(composition)
+
 def declare(combinators, prefix=None):
     '''
         derive combinator methods from combinator table
@@ -259,8 +394,8 @@ class Composition:
         if 'args' in combinator:
             for arg in combinator['args']:
                 optional = arg.get('optional', False)
-                if arg['name'] not in composition and optional and 'type' in arg:
-                    continue
+                if composition.get(arg['name']) is None and optional and 'type' in arg:
+                    continue # missing or None
                 if 'type' not in arg:
                     try:
                         value = composition.get(arg['name'], None if optional else undefined)
@@ -289,19 +424,27 @@ class Composition:
     def __str__(self):
         return json.dumps(self.__dict__, default=serialize, ensure_ascii=True)
 
-    def compile(self):
-        '''  compile composition. Returns a dictionary '''
+    def compile(self, fuse=False, resolve=None):
+        '''
+            compile composition, inlining the compositions it references by name if resolve maps names
+            to ASTs (see inline_compositions) and fusing runs of consecutive actions into native sequences
+            if fuse. Returns a dictionary
+        '''
         actions = []
 
         def flatten(composition, _=None):
             composition = visit(composition, flatten)
 
-            if composition.type == 'action' and hasattr(composition, 'action'): # pylint: disable=E1101
+            if composition.type in ('action', 'batch') and hasattr(composition, 'action'): # pylint: disable=E1101
                 actions.append({ 'name': composition.name, 'action': composition.action })
                 del composition.action # pylint: disable=E1101
             return composition
 
         obj = { 'composition': label(flatten(self)).lower(), 'ast': self, 'version': __version__ }
+        if resolve is not None:
+            obj['composition'] = inline_compositions(obj['composition'], resolve)
+        if fuse:
+            obj['composition'] = fuse_actions(obj['composition'], actions)
         if len(actions) > 0:
             obj['actions'] = actions
         return obj
@@ -360,6 +503,17 @@ combinators = {
   'asynchronous': { 'components': True, 'since': '0.6.0' },
   'execute': { 'since': '0.5.2' },
   'map': { 'components': True, 'since': '0.6.0' },
+  'parallel': { 'components': True, 'since': '0.16.0' },
+  'cpu_map': { 'args': [{ 'name': 'function', 'type': 'object' }, { 'name': 'chunk', 'type': 'int' }], 'since': '0.16.0' },
+  'race': { 'args': [{ 'name': 'stagger', 'type': 'int', 'optional': True }, { 'name': 'winner', 'type': 'str', 'optional': True }],
+    'components': True, 'since': '0.16.0' },
+  'memo': { 'args': [{ 'name': 'body' }, { 'name': 'options', 'type': 'object' }], 'since': '0.16.0' },
+  'batch': { 'args': [{ 'name': 'name', 'type': 'name' }, { 'name': 'size', 'type': 'int' }], 'since': '0.16.0' },
+  'timeout': { 'args': [{ 'name': 'ms', 'type': 'int' }, { 'name': 'body' }, { 'name': 'options', 'type': 'object' },
+    { 'name': 'fallback', 'optional': True }], 'since': '0.16.0' },
+  'breaker': { 'args': [{ 'name': 'body' }, { 'name': 'options', 'type': 'object' }, { 'name': 'fallback', 'optional': True }],
+    'since': '0.16.0' },
+  'project': { 'args': [{ 'name': 'fields', 'type': 'list' }, { 'name': 'body' }], 'since': '0.16.0' },
   'composition': { 'args': [{ 'name': 'name', 'type': 'name' }], 'since': '0.6.0' }
 }
 
@@ -381,7 +535,9 @@ extra = {
   'retain_catch': { 'components': True, 'since': '0.4.0', 'def': lowerer.retain_catch },
   'value': { 'args': [{ 'name': 'value', 'type': 'value' }], 'since': '0.4.0', 'def': lowerer.literal },
   'literal': { 'args': [{ 'name': 'value', 'type': 'value' }], 'since': '0.4.0', 'def': lowerer.literal },
-  'merge': { 'components': True, 'since': '0.13.0', 'def': lowerer.merge }
+  'merge': { 'components': True, 'since': '0.13.0', 'def': lowerer.merge },
+  'parallel_merge': { 'components': True, 'since': '0.16.0', 'def': lowerer.parallel_merge },
+  'reduce': { 'args': [{ 'name': 'reducer' }, { 'name': 'arity', 'type': 'int' }], 'since': '0.16.0', 'def': lowerer.reduce }
 }
 
 composer.__dict__.update(declare(extra).__dict__)
@@ -441,6 +597,81 @@ def function(fun):
 
 composer.function = function
 
+def cpu_map(fun, chunk):
+    ''' cpu_map combinator: functions run in worker processes and cannot access the environment '''
+    if callable(fun) and getattr(getattr(fun, '__code__', None), 'co_argcount', 1) != 1:
+        raise ComposerError('Invalid argument "function" in "cpu_map" combinator, expected a function of one argument', fun)
+    if not isinstance(chunk, int) or chunk < 1:
+        raise ComposerError('Invalid argument "chunk" in "cpu_map" combinator', chunk)
+    exc = function(fun).function['exec']
+    return Composition({ 'type': 'cpu_map', 'function': { 'exec': exc }, 'chunk': chunk, '.combinator': lambda: combinators['cpu_map'] })
+
+composer.cpu_map = cpu_map
+
+def memo(body, options={}):
+    ''' memo combinator: fill in the default options '''
+    if not isinstance(options, dict):
+        raise ComposerError('Invalid argument "options" in "memo" combinator', options)
+    options = dict({ 'key': None, 'ttl': None, 'max_entries': 1000, 'cache_errors': False }, **options)
+    key = options['key']
+    if key is not None and (not isinstance(key, list) or not all(isinstance(name, str) for name in key)):
+        raise ComposerError('Invalid argument "key" in "memo" combinator, expected a list of parameter names', key)
+    ttl = options['ttl']
+    if ttl is not None and (isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0):
+        raise ComposerError('Invalid argument "ttl" in "memo" combinator', ttl)
+    if not isinstance(options['max_entries'], int) or options['max_entries'] < 1:
+        raise ComposerError('Invalid argument "max_entries" in "memo" combinator', options['max_entries'])
+    if not isinstance(options['cache_errors'], bool):
+        raise ComposerError('Invalid argument "cache_errors" in "memo" combinator', options['cache_errors'])
+    return Composition({ 'type': 'memo', 'body': body, 'options': options, '.combinator': lambda: combinators['memo'] })
+
+composer.memo = memo
+
+def breaker(body, options={}, fallback=None):
+    ''' breaker combinator: fill in the default options and record whether there is a fallback '''
+    if not isinstance(options, dict):
+        raise ComposerError('Invalid argument "options" in "breaker" combinator', options)
+    options = dict({ 'failures': 5, 'window': 60, 'cooldown': 30 }, **options, fallback=fallback is not None)
+    if not isinstance(options['failures'], int) or options['failures'] < 1:
+        raise ComposerError('Invalid argument "failures" in "breaker" combinator', options['failures'])
+    for name in ('window', 'cooldown'):
+        if isinstance(options[name], bool) or not isinstance(options[name], (int, float)) or options[name] <= 0:
+            raise ComposerError('Invalid argument "'+name+'" in "breaker" combinator', options[name])
+    return Composition({ 'type': 'breaker', 'body': body, 'options': options, 'fallback': fallback,
+        '.combinator': lambda: combinators['breaker'] })
+
+composer.breaker = breaker
+
+def timeout(ms, body, fallback=None):
+    ''' timeout combinator: record whether there is a fallback '''
+    if isinstance(ms, bool) or not isinstance(ms, int) or ms < 1:
+        raise ComposerError('Invalid argument "ms" in "timeout" combinator', ms)
+    return Composition({ 'type': 'timeout', 'ms': ms, 'body': body, 'options': { 'fallback': fallback is not None }, 'fallback': fallback,
+        '.combinator': lambda: combinators['timeout'] })
+
+composer.timeout = timeout
+
+def batch(name, size):
+    ''' batch combinator: the action must accept batches, it may be an action combinator with a definition '''
+    if isinstance(size, bool) or not isinstance(size, int) or size < 1:
+        raise ComposerError('Invalid argument "size" in "batch" combinator', size)
+    composition = { 'type': 'batch', 'name': name, 'size': size, '.combinator': lambda: combinators['batch'] }
+    if isinstance(name, Composition) and name.type == 'action':
+        composition['name'] = name.name
+        if hasattr(name, 'action'):
+            composition['action'] = name.action
+    return Composition(composition)
+
+composer.batch = batch
+
+def project(fields, body):
+    ''' project combinator: fields are dot-separated paths of nested keys '''
+    if not isinstance(fields, list) or not all(isinstance(field, str) and all(field.split('.')) for field in fields):
+        raise ComposerError('Invalid argument "fields" in "project" combinator, expected a list of field paths', fields)
+    return Composition({ 'type': 'project', 'fields': fields, 'body': body, '.combinator': lambda: combinators['project'] })
+
+composer.project = project
+
 def action(name, options = {}):
     ''' action combinator '''
     if not isinstance(options, dict):
@@ -472,8 +703,17 @@ def main(args):
         exc = { 'kind': 'python:3', 'code': exc }
 
     composition = { 'type': 'action', 'name': name, '.combinator': lambda: combinators['action']}
-    if exc is not None:
+    if options.get('inline', False): # run by the conductor instead of deployed
+        if not isinstance(exc, dict) or not exc.get('kind', '').startswith('python') or not isinstance(exc.get('code'), str):
+            raise ComposerError('Invalid argument "options" in "action" combinator, only Python actions can be inlined', options)
+        functionName = exc.get('main', 'main')
+        if callable(options['action']) and options['action'].__name__ != '<lambda>':
+            functionName = options['action'].__name__
+        composition['inline'] = { 'kind': 'python:3', 'code': exc['code'], 'functionName': functionName }
+    elif exc is not None:
         composition['action'] = { 'exec': exc }
+        if options.get('batch', False): # declare that the action accepts batches of items
+            composition['action']['annotations'] = [{ 'key': 'batch', 'value': True }]
 
     return Composition(composition)
 
@@ -485,13 +725,17 @@ def parse(composition):
     if not isinstance(composition, dict):
         raise ComposerError('Invalid argument "composition" in "parse" combinator', composition)
 
-    combinator = composition['.combinator']() if '.combinator' in composition and callable(composition['.combinator']) else combinators[composition['type']]
+    if '.combinator' in composition and callable(composition['.combinator']):
+        combinator = composition['.combinator']()
+    else:
+        combinator = combinators.get(composition.get('type'), extra.get(composition.get('type')))
 
     if not isinstance(combinator, dict):
         raise ComposerError('Invalid composition type in "parse" combinator', composition)
 
-    extended = { '.combinator': lambda : combinator }
-    extended.update(composition)
+    # serialized compositions have a placeholder combinator field
+    extended = dict(composition)
+    extended['.combinator'] = lambda : combinator
     return visit(extended, lambda composition, _: composer.parse(composition))
 
 composer.action = action
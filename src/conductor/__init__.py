@@ -17,4 +17,4 @@
 
 __version__ = '0.15.1'
 
-from .conductor import openwhisk, synthesize
+from .conductor import openwhisk, synthesize, compile_fsm, optimize_fsm, compile_program
@@ -17,24 +17,64 @@
 
 import functools
 import json
+import hashlib
+import hmac
+import secrets
+import collections
+import sqlite3
+import concurrent.futures
+import concurrent.futures.process
+import time
 import marshal
 import base64
+import zlib
 import types
 import os
 import inspect
 import composer
-import re
 import requests
 import traceback
 from conductor import __version__
 
-def escape(str):
-    return re.sub(r'(\n|\t|\r|\f|\v|\\|\')', lambda m:{'\n':'\\n','\t':'\\t','\r':'\\r','^\f':'\\f','\v':'\\v','\\':'\\\\','\'':'\\\''}[m.group()], str)
-
 def synthesize(composition): # dict
-    code = '# generated by composer v'+composition['version']+' and conductor v'+__version__+'\n\nimport os\nimport functools\nimport json\nimport inspect\nimport re\nimport base64\nimport marshal\nimport types\nimport requests\nimport urllib.parse'
+    code = '# generated by composer v'+composition['version']+' and conductor v'+__version__+'\n\nimport os\nimport functools\nimport json'
+    code += '\nimport hashlib\nimport collections\nimport sqlite3\nimport concurrent.futures\nimport concurrent.futures.process'
+    code += '\nimport time\nimport inspect\nimport re\nimport base64\nimport hmac'
+    code += '\nimport zlib\nimport marshal\nimport types\nimport requests\nimport urllib.parse'
     code += '\n\n' + inspect.getsource(composer.ComposerError)
-    code += '\ncomposition=json.loads(\''+escape(json.dumps(composition['composition'], default=composer.serialize, ensure_ascii=True))+'\')'
+
+    options = dict(composition.get('conductor', {}))
+    for option in ('memo_store', 'claim_check'):
+        if inspect.isclass(options.get(option)):
+            # a store class is embedded by source, see plugin
+            options[option] = { 'class': options[option].__name__, 'code': inspect.getsource(options[option]) }
+    if options.get('claim_check') is not None and 'claim_secret' not in options:
+        options['claim_secret'] = secrets.token_hex(32) # signs the claim check references of this deployment
+    program = None
+    # the generated program has no states to count, max_states requires the interpreter
+    if options.pop('backend', 'fsm') == 'python' and options.get('max_states') is None:
+        try:
+            program = compile_program(composition['composition'])
+            compile(program, 'program', 'exec')
+        except (SyntaxError, RecursionError) as err:
+            # only a composition too deeply nested for the Python compiler falls back to the interpreter
+            if isinstance(err, SyntaxError) and err.msg != 'too many statically nested blocks':
+                raise
+            print('Warning: falling back to the fsm backend, the generated program cannot be compiled:', err)
+            program = None
+
+    if program is None:
+        fsm, removed = optimize_fsm(compile_fsm(composition['composition']))
+        code += '\n# '+str(len(fsm['code']))+' states, '+str(removed)+' removed by the optimizer'
+    else:
+        # the generated program replaces the FSM
+        fsm = { 'opcodes': list(opcodes), 'code': [], 'next': [], 'arg': [], 'path': [], 'paths': [], 'handlers': [], 'finalizers': [] }
+        code += '\n' + program
+    code += '\nfsm=' + repr(fsm)
+    code += '\n' + inspect.getsource(map_chunk)
+    code += '\n' + inspect.getsource(MemoryStore)
+    code += '\n' + inspect.getsource(SQLiteStore)
+    code += '\n' + inspect.getsource(FileStore)
     code += '\n' + inspect.getsource(conductor)
     code += '\n' + inspect.getsource(openwhisk)
     code += '\n' + inspect.getsource(Compositions)
@@ -51,6 +91,16 @@ def synthesize(composition): # dict
     code += '\n' + inspect.getsource(composer.set_nested_result)
     code += '\n' + inspect.getsource(composer.get_nested_result)
     code += '\n' + inspect.getsource(composer.retry_cond)
+    code += '\n' + inspect.getsource(composer.merge_results)
+    code += '\n' + inspect.getsource(composer.reduce_cond)
+    code += '\n' + inspect.getsource(composer.reduce_groups)
+    code += '\n' + inspect.getsource(composer.reduce_results)
+    code += '\n' + inspect.getsource(composer.reduce_round)
+    code += '\n' + inspect.getsource(composer.reduce_pending)
+    code += '\n' + inspect.getsource(composer.reduce_group)
+    code += '\n' + inspect.getsource(composer.reduce_collect)
+    code += '\n' + inspect.getsource(composer.reduce_folded)
+    code += '\n' + inspect.getsource(composer.reduce_result)
 
     import openwhisk as ow
     code += '\n' + inspect.getsource(ow.Client)
@@ -61,11 +111,13 @@ def synthesize(composition): # dict
     code += '\n' + inspect.getsource(ow.parse_id)
     code += '\n' + inspect.getsource(ow.parse_namespace)
 
-    code += 'def main(args):'
-    code += '\n    return conductor(composition)(args)'
+    # the FSM is compiled at deploy time, warm activations reuse the conductor
+    code += '\ninvoke = conductor(fsm, '+('' if program is None else 'program=program, ')+'**'+repr(options)+')'
+    code += '\n\ndef main(args):'
+    code += '\n    return invoke(args)'
 
     annotations = [
-        { 'key': 'conductor', 'value': str(composition['ast']) },
+        { 'key': 'conductor', 'value': json.dumps(composition['ast'], default=composer.serialize, ensure_ascii=True) },
         { 'key': 'composerVersion', 'value': composition['version'] },
         { 'key': 'conductorVersion', 'value': __version__ },
         { 'key': 'provide-api-key', 'value': True },
@@ -114,12 +166,33 @@ class Compositions:
     ''' management class for compositions '''
     def __init__(self, wsk):
         self.actions = wsk.actions
-
-    def deploy(self, composition, overwrite):
+        self.asts = {} # ASTs of deployed compositions by name, None for other actions
+
+    def resolve(self, name):
+        ''' AST of the composition deployed as action name if any, read from its conductor annotation once '''
+        if name not in self.asts:
+            try:
+                annotations = self.actions.get({ 'name': name }).get('annotations', [])
+                ast = next((annotation['value'] for annotation in annotations if annotation.get('key') == 'conductor'), None)
+                # conductor actions not deployed by composer are annotated with true
+                ast = json.loads(ast) if isinstance(ast, str) else ast
+                self.asts[name] = composer.parse(ast) if isinstance(ast, dict) else None
+            except Exception as err:
+                print(err) # missing action or unreadable annotation, keep invoking name as a plain action
+                self.asts[name] = None
+        return self.asts[name]
+
+    def deploy(self, composition, overwrite, inline=False):
+        if inline: # splice the compositions invoked by name
+            lowered = composition['composition']
+            lowered = lowered if isinstance(lowered, composer.Composition) else composer.parse(lowered)
+            composition = dict(composition, composition=composer.inline_compositions(lowered, self.resolve))
         actions = composition.get('actions', [])
         actions.append(synthesize(composition))
 
         for action in actions:
+            if self.shared(action):
+                continue # fused for another composition, identical by construction
             if overwrite:
                 try:
                     self.actions.delete(action)
@@ -129,13 +202,32 @@ class Compositions:
 
         return actions
 
-def conductor(composition): # main.
-    wsk = None
-    isObject = lambda x: isinstance(x, dict)
+    def shared(self, action):
+        ''' whether action is a native sequence of fused actions that is already deployed, its name is derived from its components '''
+        if action['action'].get('exec', {}).get('kind') != 'sequence' or not action['name'].startswith('/_/composer-sequence-'):
+            return False
+        try:
+            self.actions.get({ 'name': action['name'] })
+            return True
+        except Exception:
+            return False
+
+# operations of the conductor FSM, states refer to them by index
+opcodes = ('pass', 'choice', 'let', 'exit', 'action', 'function', 'empty', 'async', 'stop', 'map', 'parallel', 'race', 'cpu_map',
+    'memo', 'store', 'breaker', 'trip', 'timeout', 'batch', 'inline', 'project', 'merge', 'unwind')
+
+def compile_fsm(composition):
+    '''
+        compile a lowered composition to the conductor FSM, a dictionary of parallel arrays
+        indexed by state: operation (code), absolute address of the next state (next),
+        operand (arg) and AST path (path, an index in the table of distinct paths)
+    '''
+    if not isinstance(composition, dict):
+        composition = json.loads(json.dumps(composition, default=composer.serialize))
 
-    # compile AST to FSM
     compiler = {}
     astnode = lambda f: compiler.setdefault(f.__name__[1:], f)
+    timers = [0] # number of timeout combinators enclosing the current node
 
     @astnode
     def _sequence(parent, node):
@@ -145,6 +237,13 @@ def conductor(composition): # main.
 
     @astnode
     def _action(parent, node):
+        if 'inline' in node:
+            return [{ 'parent': parent, 'type': 'inline', 'name': node['name'], 'exec': node['inline'] }]
+        return [{ 'parent': parent, 'type': 'action', 'name': node['name'] }]
+
+    @astnode
+    def _composition(parent, node):
+        # a composition that was not inlined runs in a conductor action of its own
         return [{ 'parent': parent, 'type': 'action', 'name': node['name'] }]
 
     @astnode
@@ -152,16 +251,92 @@ def conductor(composition): # main.
         body = compile(parent, *node['components'])
         return [{ 'parent': parent, 'type': 'async', 'return': len(body) + 2}, *body, {'parent': parent, 'type': 'stop' }, {'parent': parent, 'type': 'pass' }]
 
+    @astnode
+    def _map(parent, node):
+        body = compile(parent, *node['components'])
+        return [{ 'parent': parent, 'type': 'map', 'return': len(body) + 2}, *body,
+            {'parent': parent, 'type': 'stop' }, {'parent': parent, 'type': 'pass' }]
+
+    @astnode
+    def _parallel(parent, node):
+        return branches(parent, node, { 'parent': parent, 'type': 'parallel', 'branches': [] })
+
+    @astnode
+    def _race(parent, node):
+        race = { 'parent': parent, 'type': 'race', 'branches': [], 'stagger': node.get('stagger') or 0, 'winner': node.get('winner') }
+        return branches(parent, node, race)
+
+    def branches(parent, node, fork):
+        ''' states of a combinator running each of its components in its own session '''
+        fsm = [fork]
+        for component in node['components']:
+            fsm[0]['branches'].append(len(fsm))
+            fsm.extend([{ 'parent': parent, 'type': 'spawn' }, *compile(parent, component), { 'parent': parent, 'type': 'stop' }])
+        fsm[0]['next'] = len(fsm)
+        fsm.append({ 'parent': parent, 'type': 'pass' })
+        return fsm
+
     @astnode
     def _function(parent, node):
         return [{ 'parent': parent, 'type': 'function', 'exec': node['function']['exec'] }]
 
+    @astnode
+    def _cpu_map(parent, node):
+        return [{ 'parent': parent, 'type': 'cpu_map', 'exec': node['function']['exec'], 'chunk': node['chunk'] }]
+
+    @astnode
+    def _memo(parent, node):
+        body = compile(parent, node['body'])
+        options = memo_options(node)
+        if options['cache_errors']:
+            # errors of the body are stored too before being propagated
+            body = [{ 'parent': parent, 'type': 'try', 'catch': len(body) + 2 }, *body, { 'parent': parent, 'type': 'exit' }]
+        return [{ 'parent': parent, 'type': 'memo', 'options': options, 'skip': len(body) + 2 }, *body,
+            { 'parent': parent, 'type': 'store', 'options': options }, { 'parent': parent, 'type': 'pass' }]
+
+    @astnode
+    def _timeout(parent, node):
+        timers[0] += 1
+        body = compile(parent, node['body'])
+        timers[0] -= 1
+        fallback = compile(parent, node['fallback'])
+        # the fallback runs once the body is abandoned, the body runs above a frame recording its deadline
+        return [{ 'parent': parent, 'type': 'timeout', 'options': dict(node['options'], ms=node['ms']), 'expire': len(body) + 2 }, *body,
+            { 'parent': parent, 'type': 'exit', 'next': len(fallback) + 1 }, *fallback, { 'parent': parent, 'type': 'pass' }]
+
+    @astnode
+    def _breaker(parent, node):
+        body = compile(parent, node['body'])
+        fallback = compile(parent, node['fallback'])
+        options = breaker_options(node)
+        # the outcome of the body is recorded whether it fails or not, the fallback runs instead of the body when open
+        return [{ 'parent': parent, 'type': 'breaker', 'options': options, 'open': len(body) + 4 },
+            { 'parent': parent, 'type': 'try', 'catch': len(body) + 2 }, *body, { 'parent': parent, 'type': 'exit' },
+            { 'parent': parent, 'type': 'trip', 'options': options, 'next': len(fallback) + 1 }, *fallback,
+            { 'parent': parent, 'type': 'pass' }]
+
+    @astnode
+    def _batch(parent, node):
+        return [{ 'parent': parent, 'type': 'batch', 'name': node['name'], 'size': node['size'] }]
+
+    @astnode
+    def _project(parent, node):
+        # the body runs on the selected fields above a frame saving the params
+        return [{ 'parent': parent, 'type': 'project', 'fields': node['fields'] }, *compile(parent, node['body']),
+            { 'parent': parent, 'type': 'merge', 'fields': node['fields'] }]
+
     @astnode
     def _ensure(parent, node):
         body = compile(parent, node['body'])
         finalizer = compile(parent, node['finalizer'])
+        if timers[0] > 0:
+            # the finalizer also runs when a timeout combinator abandons the body, unwinding resumes after it even if it fails
+            finalizer = [{ 'parent': parent, 'type': 'try', 'catch': len(finalizer) + 2 }, *finalizer, { 'parent': parent, 'type': 'exit' },
+                { 'parent': parent, 'type': 'unwind' }]
         fsm = [{ 'parent': parent, 'type': 'try'}, *body, { 'parent': parent, 'type': 'exit' }, *finalizer]
         fsm[0]['catch'] = len(fsm) - len(finalizer)
+        if timers[0] > 0:
+            fsm[0]['unwind'] = len(fsm) - 1
         return fsm
 
     @astnode
@@ -186,7 +361,7 @@ def conductor(composition): # main.
     @astnode
     def _when_nosave(parent, node):
         consequent = compile(parent, node['consequent'])
-        alternate = [ *compile(parent, node['alternate']), { parent: 'parent', 'type': 'pass' }]
+        alternate = [ *compile(parent, node['alternate']), { 'parent': parent, 'type': 'pass' }]
         fsm = [{ 'parent': parent, 'type': 'pass' },
             *compile(parent, node['test']),
             { 'parent': parent, 'type': 'choice', 'then': 1, 'else': len(consequent) + 1 },
@@ -201,7 +376,7 @@ def conductor(composition): # main.
         test = compile(parent, node['test'])
         fsm = [{ 'parent': parent, 'type': 'pass' }, *test,
             { 'parent': parent, 'type': 'choice', 'then': 1, 'else': len(body) + 1 },
-            *body, { parent: 'parent', 'type': 'pass' }]
+            *body, { 'parent': parent, 'type': 'pass' }]
         fsm[len(fsm) - 2]['next'] = 2 - len(fsm)
         return fsm
 
@@ -210,7 +385,7 @@ def conductor(composition): # main.
         body = compile(parent, node['body'])
         test = compile(parent, node['test'])
         fsm = [{ 'parent': parent, 'type': 'pass' }, *body, *test,
-               { 'parent': parent, 'type': 'choice', 'else': 1}, { parent: 'parent', 'type': 'pass' }]
+               { 'parent': parent, 'type': 'choice', 'else': 1}, { 'parent': parent, 'type': 'pass' }]
         fsm[len(fsm) - 2]['then'] = 2 - len(fsm)
         return fsm
 
@@ -227,78 +402,1321 @@ def conductor(composition): # main.
         l.extend(items)
         return l
 
-    fsm = compile('', composition)
+    states = compile('', composition)
+
+    # error handlers are static: record the range of states covered by each try block together
+    # with the address of its handler and the depth of the runtime stack when entering the block,
+    # asynchronous, map, parallel and race bodies are covered by a range without handler so errors never escape them,
+    # memo, timeout and project bodies run above the frame recording the key of the cached result, the deadline or the params;
+    # the finalizers of the ensure combinators within timeout bodies are also recorded with the address of their unwind state
+    handlers = []
+    finalizers = []
+    blocks = []
+    depth = 0
+    for index, state in enumerate(states):
+        if state['type'] in ('try', 'let', 'async', 'map', 'spawn', 'memo', 'timeout', 'project'):
+            blocks.append((index, depth))
+            if state['type'] != 'try':
+                depth += 1
+        elif state['type'] in ('exit', 'stop', 'store', 'merge'):
+            start, depth = blocks.pop()
+            if states[start]['type'] == 'try':
+                handlers.append([start + 1, index, start + states[start]['catch'], depth])
+                if 'unwind' in states[start]:
+                    finalizers.append([start + 1, index, start + states[start]['catch'], depth, start + states[start]['unwind']])
+                states[start] = { 'parent': states[start]['parent'], 'type': 'pass' }
+                states[index] = dict(state, type='pass')
+            elif states[start]['type'] in ('async', 'map', 'spawn'):
+                handlers.append([start + 1, index, -1, depth])
+                if states[start]['type'] == 'spawn':
+                    states[start] = { 'parent': states[start]['parent'], 'type': 'pass' }
+
+    # assemble the states into parallel arrays with absolute jump targets and interned paths
+    fsm = { 'opcodes': list(opcodes), 'code': [], 'next': [], 'arg': [], 'path': [], 'paths': [], 'handlers': handlers,
+        'finalizers': finalizers }
+    paths = {}
+    for index, state in enumerate(states):
+        fsm['code'].append(opcodes.index(state['type']))
+        fsm['next'].append(index + state.get('then' if state['type'] == 'choice' else 'next', 1))
+        if state['type'] == 'choice':
+            fsm['arg'].append(index + state['else'])
+        elif state['type'] in ('async', 'map'):
+            fsm['arg'].append(index + state['return'])
+        elif state['type'] in ('parallel', 'race'):
+            fsm['arg'].append({ 'branches': [index + branch for branch in state['branches']], 'stagger': state.get('stagger', 0),
+                'winner': state.get('winner') })
+        elif state['type'] == 'action':
+            fsm['arg'].append(state['name'])
+        elif state['type'] == 'function':
+            fsm['arg'].append(state['exec'])
+        elif state['type'] == 'cpu_map':
+            fsm['arg'].append({ 'exec': state['exec'], 'chunk': state['chunk'] })
+        elif state['type'] == 'batch':
+            fsm['arg'].append({ 'name': state['name'], 'size': state['size'] })
+        elif state['type'] == 'inline':
+            fsm['arg'].append({ 'name': state['name'], 'exec': state['exec'] })
+        elif state['type'] == 'memo':
+            fsm['arg'].append(dict(state['options'], skip=index + state['skip']))
+        elif state['type'] == 'breaker':
+            fsm['arg'].append(dict(state['options'], open=index + state['open']))
+        elif state['type'] == 'timeout':
+            fsm['arg'].append(dict(state['options'], expire=index + state['expire']))
+        elif state['type'] in ('store', 'trip'):
+            fsm['arg'].append(state['options'])
+        elif state['type'] in ('project', 'merge'):
+            fsm['arg'].append(state['fields'])
+        else:
+            fsm['arg'].append(state.get('let'))
+        fsm['path'].append(paths.setdefault(state['parent'], len(paths)))
+    fsm['paths'] = list(paths)
+
+    return fsm
+
+def fingerprint(node):
+    ''' name of a combinator derived from its canonical JSON, identical combinators share the same name wherever they occur '''
+    def strip(value):
+        if isinstance(value, dict):
+            return { key: strip(item) for key, item in value.items() if key != 'path' or 'type' not in value }
+        if isinstance(value, list):
+            return [strip(item) for item in value]
+        return value
+    return hashlib.sha256(json.dumps(strip(node), sort_keys=True).encode()).hexdigest()
+
+def memo_options(node):
+    ''' options of a memo combinator, naming its cache after the node so that identical nodes share results '''
+    return dict(node['options'], cache=fingerprint(node))
+
+def breaker_options(node):
+    ''' options of a breaker combinator, naming it after the node so that identical nodes share statistics '''
+    return dict(node['options'], breaker=fingerprint(node))
+
+def optimize_fsm(fsm):
+    '''
+        remove the states of the conductor FSM that have no effect: pass states, empty states
+        that can only see already inspected params, and let/exit pairs enclosing nothing;
+        jumps are threaded to their final target. Returns the optimized FSM and the number of
+        states removed
+    '''
+    code, target, arg = fsm['code'], list(fsm['next']), fsm['arg']
+    op = lambda index: fsm['opcodes'][code[index]]
+    n = len(code)
+
+    # params may be uninspected when entering a session, a handler, a spawned body or the fallback of
+    # a breaker or timeout, and remain so through pass, let, exit, memo, breaker, timeout, unwind and choice
+    # states until any other state inspects them
+    dirty = set()
+    entries = [0] + [catch for _, _, catch, _ in fsm['handlers'] if catch >= 0]
+    entries += [target[index] for index in range(n) if op(index) in ('async', 'map')]
+    entries += [branch for index in range(n) if op(index) in ('parallel', 'race') for branch in arg[index]['branches']]
+    entries += [arg[index]['open'] for index in range(n) if op(index) == 'breaker']
+    entries += [arg[index]['expire'] for index in range(n) if op(index) == 'timeout']
+    while len(entries) > 0:
+        index = entries.pop()
+        if 0 <= index < n and index not in dirty:
+            dirty.add(index)
+            if op(index) in ('pass', 'let', 'exit', 'memo', 'breaker', 'timeout', 'unwind'):
+                entries.append(target[index])
+            elif op(index) == 'choice':
+                entries.extend([target[index], arg[index]])
+
+    removed = [op(index) == 'pass' or (op(index) == 'empty' and index not in dirty) for index in range(n)]
+
+    def resolve(index):
+        ''' follow jumps through removed states '''
+        seen = set()
+        while 0 <= index < n and removed[index] and index not in seen:
+            seen.add(index)
+            index = target[index]
+        return index
+
+    # merge let/exit pairs enclosing nothing, innermost first
+    merged = True
+    while merged:
+        merged = False
+        for index in range(n):
+            if not removed[index] and op(index) == 'let':
+                end = resolve(target[index])
+                if end < n and op(end) == 'exit' and all(removed[index + 1:end]):
+                    removed[index] = removed[end] = merged = True
+                    target[index] = target[end]
+
+    # the entry state must stay first
+    if removed[0] and any(not removed[index] for index in range(resolve(0))):
+        removed[0] = False
+        code, target, arg = list(code), list(target), list(arg)
+        code[0], target[0], arg[0] = fsm['opcodes'].index('pass'), resolve(0), None
+        op = lambda index: fsm['opcodes'][code[index]]
+
+    # new address of every state, removed states are mapped to the next state kept
+    rank = [0] * (n + 1)
+    for index in range(n):
+        rank[index + 1] = rank[index] + (0 if removed[index] else 1)
+    address = lambda index: rank[resolve(index)] if 0 <= index else index
+
+    optimized = { 'opcodes': fsm['opcodes'], 'code': [], 'next': [], 'arg': [], 'path': [], 'paths': [], 'handlers': [],
+        'finalizers': [] }
+    paths = {}
+    for index in range(n):
+        if not removed[index]:
+            optimized['code'].append(code[index])
+            optimized['next'].append(address(target[index]))
+            if op(index) in ('choice', 'async', 'map'):
+                optimized['arg'].append(address(arg[index]))
+            elif op(index) in ('parallel', 'race'):
+                optimized['arg'].append(dict(arg[index], branches=[address(branch) for branch in arg[index]['branches']]))
+            elif op(index) == 'memo':
+                optimized['arg'].append(dict(arg[index], skip=address(arg[index]['skip'])))
+            elif op(index) == 'breaker':
+                optimized['arg'].append(dict(arg[index], open=address(arg[index]['open'])))
+            elif op(index) == 'timeout':
+                optimized['arg'].append(dict(arg[index], expire=address(arg[index]['expire'])))
+            else:
+                optimized['arg'].append(arg[index])
+            optimized['path'].append(paths.setdefault(fsm['paths'][fsm['path'][index]], len(paths)))
+    optimized['paths'] = list(paths)
+    for start, end, catch, depth in fsm['handlers']:
+        if rank[start] < rank[end]:
+            optimized['handlers'].append([rank[start], rank[end], address(catch), depth])
+    for start, end, catch, depth, finish in fsm['finalizers']:
+        if rank[start] < rank[end]:
+            optimized['finalizers'].append([rank[start], rank[end], address(catch), depth, address(finish)])
+    # continuation states without version name a state of the unoptimized FSM
+    optimized['legacy'] = [address(index) for index in range(n)]
+
+    return optimized, n - len(optimized['code'])
+
+def compile_program(composition):
+    '''
+        compile a lowered composition to the source of a Python program with structured control
+        flow, an alternative to interpreting the conductor FSM. Sessions suspend at action and
+        async boundaries and at the start of loop iterations, numbered depth first from 1, and resume from the suspension point (pc)
+        recorded in the $composer state; nodes whose range of suspension points (lo, hi] does
+        not contain the resumed point are skipped
+    '''
+    if not isinstance(composition, dict):
+        composition = json.loads(json.dumps(composition, default=composer.serialize))
+
+    generator = {}
+    astnode = lambda f: generator.setdefault(f.__name__[1:], f)
+
+    constants = {} # distinct function combinators, inline actions and combinator options, hoisted out of the program
+    points = [0] # number of suspension points so far
+    flags = [0] # number of handler flags so far
+    timers = {} # paths of the timeout combinators enclosing the current node by depth of their frame
+    lets = [] # static declarations of each let combinator, the origins of let frames
+
+    indent = lambda lines: ['    ' + line for line in lines]
+    within = lambda lo, hi: str(lo)+' < pc <= '+str(hi) if lo < hi else 'False'
+    guard = lambda lo, hi: 'pc == 0 or '+within(lo, hi) if lo < hi else 'pc == 0'
+    inspect_errors = ['if failed(p): raise Failure']
+    test_value = ["if not p['params']['value']:", '    break']
+    iteration = ['if budget == 0:', '    return exhausted()', 'budget -= 1']
+    watch = lambda: ['watch(stack)'] if len(timers) > 0 else []
+
+    @astnode
+    def _sequence(parent, node, depth):
+        return generate(parent, depth, *node['components'])
+
+    @astnode
+    def _action(parent, node, depth):
+        if 'inline' in node:
+            constant = constants.setdefault(repr(node['inline']), len(constants))
+            return ['perform(p, f'+str(constant)+', '+repr(node['name'])+')', *watch(), *inspect_errors]
+        points[0] += 1
+        return ['if pc == 0:', '    return request(p, '+repr(node['name'])+', '+str(points[0])+')', 'pc = 0', *watch(), *inspect_errors]
+
+    @astnode
+    def _composition(parent, node, depth):
+        points[0] += 1
+        return ['if pc == 0:', '    return request(p, '+repr(node['name'])+', '+str(points[0])+')', 'pc = 0', *watch(), *inspect_errors]
+
+    @astnode
+    def _asynchronous(parent, node, depth):
+        points[0] += 1
+        lo = points[0]
+        body = generate(parent, depth + 1, *node['components'])
+        # the spawned session enters the body at pc == lo, errors never escape the body
+        return ['if '+str(lo)+' <= pc <= '+str(points[0])+':',
+            '    if pc == '+str(lo)+':', '        pc = 0',
+            '    try:', *indent(indent(body)), '    except Failure:', '        pass',
+            '    return None',
+            'fork(p, '+str(lo)+', '+repr(parent)+')', *inspect_errors]
+
+    @astnode
+    def _map(parent, node, depth):
+        points[0] += 1
+        lo = points[0]
+        body = generate(parent, depth + 1, *node['components'])
+        # the session of each element enters the body at pc == lo
+        return ['if '+str(lo)+' <= pc <= '+str(points[0])+':',
+            '    if pc == '+str(lo)+':', '        pc = 0',
+            '    try:', *indent(indent(body)), '    except Failure:', '        pass',
+            '    return None',
+            'scatter(p, '+str(lo)+', '+repr(parent)+')', *inspect_errors]
+
+    @astnode
+    def _parallel(parent, node, depth):
+        code, branches = spawn(parent, node, depth)
+        return [*code, 'join(p, '+repr(branches)+', '+repr(parent)+')', *inspect_errors]
+
+    @astnode
+    def _race(parent, node, depth):
+        code, branches = spawn(parent, node, depth)
+        race = repr(branches)+', '+repr(node.get('stagger') or 0)+', '+repr(node.get('winner'))
+        return [*code, 'first(p, '+race+', '+repr(parent)+')', *inspect_errors]
+
+    def spawn(parent, node, depth):
+        ''' code of the sessions running each component of node, with their entry points '''
+        code = []
+        branches = []
+        for component in node['components']:
+            points[0] += 1
+            lo = points[0]
+            branches.append(lo)
+            body = generate(parent, depth + 1, component)
+            # the session of each branch enters its body at pc == lo
+            code.extend(['if '+str(lo)+' <= pc <= '+str(points[0])+':',
+                '    if pc == '+str(lo)+':', '        pc = 0',
+                '    try:', *indent(indent(body)), '    except Failure:', '        pass',
+                '    return None'])
+        return code, branches
+
+    @astnode
+    def _function(parent, node, depth):
+        constant = constants.setdefault(repr(node['function']['exec']), len(constants))
+        return ['evaluate(p, f'+str(constant)+', '+repr(parent)+')', *watch(), *inspect_errors]
+
+    @astnode
+    def _cpu_map(parent, node, depth):
+        constant = constants.setdefault(repr(node['function']['exec']), len(constants))
+        return ['offload(p, f'+str(constant)+', '+str(node['chunk'])+', '+repr(parent)+')', *watch(), *inspect_errors]
+
+    @astnode
+    def _memo(parent, node, depth):
+        lo = points[0]
+        body = generate(parent, depth + 1, node['body'])
+        constant = constants.setdefault(repr(memo_options(node)), len(constants))
+        options = 'f'+str(constant)
+        if node['options']['cache_errors']:
+            body = ['try:', *indent(body), 'except Failure:', '    del stack['+str(depth + 1)+':]']
+        # a resumed session is past the lookup
+        hit = 'recall(p, '+options+')' if points[0] == lo else 'pc == 0 and recall(p, '+options+')'
+        return ['if '+hit+':', *indent(inspect_errors), 'else:', *indent([*body, 'memorize(p, '+options+')', *inspect_errors])]
+
+    @astnode
+    def _timeout(parent, node, depth):
+        lo = points[0]
+        timers[depth] = parent
+        body = generate(parent, depth + 1, node['body'])
+        del timers[depth]
+        mid = points[0]
+        fallback = generate(parent, depth, node['fallback'])
+        constant = constants.setdefault(repr(dict(node['options'], ms=node['ms'])), len(constants))
+        enter = 'push(stack, TIMEOUT, arm(p, f'+str(constant)+', None))'
+        # the fallback runs outside of the try block so that resuming into it is possible
+        flags[0] += 1
+        flag = 'expired'+str(flags[0])
+        return [flag+' = '+within(mid, points[0]),
+            'if '+guard(lo, mid)+':',
+            '    try:', *indent(indent([*(['if pc == 0:', '    ' + enter] if mid > lo else [enter]), *body, 'stack.pop()'])),
+            '    except Expired as expiry:',
+            '        if expiry.depth != '+str(depth)+':', '            raise',
+            '        interrupt(p, '+str(depth)+', '+repr(parent)+')', '        '+flag+' = True',
+            'if '+flag+':', *indent(fallback)]
+
+    @astnode
+    def _breaker(parent, node, depth):
+        lo = points[0]
+        body = generate(parent, depth, node['body'])
+        mid = points[0]
+        fallback = generate(parent, depth, node['fallback'])
+        constant = constants.setdefault(repr(breaker_options(node)), len(constants))
+        args = 'p, f'+str(constant)+', '+repr(parent)
+        closed = ['try:', *indent(body), 'except Failure:', '    del stack['+str(depth)+':]', 'trip('+args+')', *inspect_errors]
+        if points[0] == lo:
+            return ['if admit('+args+'):', *indent(closed), 'else:', *indent(fallback)]
+        # a resumed session is past the admission
+        flags[0] += 1
+        flag = 'admitted'+str(flags[0])
+        return [flag+' = admit('+args+') if pc == 0 else '+within(lo, mid), 'if '+flag+':', *indent(closed), 'else:', *indent(fallback)]
+
+    @astnode
+    def _batch(parent, node, depth):
+        return ['batch(p, '+repr(node['name'])+', '+str(node['size'])+', '+repr(parent)+')', *watch(), *inspect_errors]
+
+    @astnode
+    def _project(parent, node, depth):
+        lo = points[0]
+        body = generate(parent, depth + 1, node['body'])
+        enter = ['project(p, '+repr(node['fields'])+')', *inspect_errors]
+        leave = ['merge(p, '+repr(node['fields'])+')', *inspect_errors]
+        return [*(['if pc == 0:', *indent(enter)] if points[0] > lo else enter), *body, *leave]
+
+    @astnode
+    def _ensure(parent, node, depth):
+        lo = points[0]
+        body = generate(parent, depth, node['body'])
+        mid = points[0]
+        finalizer = generate(parent, depth, node['finalizer'])
+        block = ['try:', *indent(body), 'except Failure:', '    del stack['+str(depth)+':]']
+        if len(timers) > 0:
+            # the finalizer also runs when a timeout combinator abandons the body, unwinding resumes after it even if it fails
+            flags[0] += 1
+            block += ['except Expired as expiry:',
+                '    abandon(p, expiry.depth, '+str(flags[0])+', '+str(depth)+', '+repr(dict(timers))+'[expiry.depth])']
+            finalizer = ['try:', *indent(finalizer), 'except Failure:', '    del stack['+str(depth)+':]',
+                'expiry = unwound(stack, '+str(flags[0])+')', 'if expiry is not None:', '    raise Expired(expiry)', *inspect_errors]
+        if points[0] == lo:
+            return [*block, *finalizer]
+        return ['if '+guard(lo, mid)+':', *indent(block), *finalizer]
+
+    @astnode
+    def _let(parent, node, depth):
+        lo = points[0]
+        body = generate(parent, depth + 1, *node['components'])
+        enter = 'push(stack, LET, '+repr(node['declarations'])+', '+str(len(lets))+')'
+        lets.append(node['declarations'])
+        return [*(['if pc == 0:', '    ' + enter] if points[0] > lo else [enter]), *body, 'stack.pop()']
+
+    @astnode
+    def _mask(parent, node, depth):
+        lo = points[0]
+        body = generate(parent, depth + 1, *node['components'])
+        enter = 'push(stack, MASK, None)'
+        return [*(['if pc == 0:', '    ' + enter] if points[0] > lo else [enter]), *body, 'stack.pop()']
+
+    @astnode
+    def _do(parent, node, depth):
+        lo = points[0]
+        body = generate(parent, depth, node['body'])
+        mid = points[0]
+        handler = generate(parent, depth, node['handler'])
+        if points[0] == lo:
+            return ['try:', *indent(body), 'except Failure:', '    del stack['+str(depth)+':]', *indent(handler)]
+        # the handler runs outside of the try block so that resuming into it is possible
+        flags[0] += 1
+        flag = 'failure'+str(flags[0])
+        return [flag+' = '+within(mid, points[0]),
+            'if '+guard(lo, mid)+':',
+            '    try:', *indent(indent(body)), '    except Failure:', '        del stack['+str(depth)+':]', '        '+flag+' = True',
+            'if '+flag+':', *indent(handler)]
+
+    @astnode
+    def _when_nosave(parent, node, depth):
+        lo = points[0]
+        test = generate(parent, depth, node['test'])
+        mid = points[0]
+        consequent = generate(parent, depth, node['consequent'])
+        end = points[0]
+        alternate = generate(parent, depth, node['alternate'])
+        if points[0] == lo:
+            return [*test, "if p['params']['value']:", *indent(consequent), 'else:', *indent(alternate)]
+        return ['if '+guard(lo, mid)+':', *indent(test), "    branch = p['params']['value']",
+            'else:', '    branch = '+within(mid, end),
+            'if branch:', *indent(consequent), 'else:', *indent(alternate)]
+
+    def head():
+        ''' code starting each iteration of a loop, where a session that yielded resumes '''
+        points[0] += 1
+        return ['if pc == '+str(points[0])+':', '    pc = 0', *watch()]
+
+    def tail(point):
+        ''' code ending each iteration of a loop, the session may yield there to resume at the head in a fresh activation '''
+        return [*iteration, 'if near():', '    return pause(p, '+str(point)+')']
+
+    @astnode
+    def _loop_nosave(parent, node, depth):
+        start = head()
+        lo = points[0]
+        test = generate(parent, depth, node['test'])
+        mid = points[0]
+        body = generate(parent, depth, node['body'])
+        if points[0] == lo:
+            return ['while True:', *indent([*start, *test, *test_value, *body, *tail(lo)])]
+        return ['while True:', *indent([*start, 'if '+guard(lo, mid)+':', *indent([*test, *test_value]), *body, *tail(lo)])]
+
+    @astnode
+    def _doloop_nosave(parent, node, depth):
+        start = head()
+        lo = points[0]
+        body = generate(parent, depth, node['body'])
+        mid = points[0]
+        test = generate(parent, depth, node['test'])
+        if points[0] == lo:
+            return ['while True:', *indent([*start, *body, *test, *test_value, *tail(lo)])]
+        return ['while True:', *indent([*start,
+            'if '+guard(lo, mid)+':', *indent(body),
+            'if '+guard(mid, points[0])+':', *indent([*test, *test_value]),
+            *tail(lo)])]
+
+    def generate(parent, depth, *nodes):
+        ''' code of a sequence of nodes, each guarded by the range of its suspension points '''
+        if len(nodes) == 0:
+            return inspect_errors
+        start = points[0]
+        parts = []
+        for node in nodes:
+            lo = points[0]
+            lines = generator[node['type']](node['path'] if 'path' in node else parent, node, depth)
+            parts.append((lo, points[0], lines))
+        if points[0] == start or len(parts) == 1:
+            return [line for _, _, lines in parts for line in lines]
+        return [line for lo, hi, lines in parts for line in ['if '+guard(lo, hi)+':', *indent(lines)]]
+
+    body = generate('', 0, composition)
+
+    return '\n'.join([
+        'def program(runtime):',
+        '    (evaluate, perform, offload, batch, request, fork, scatter, join, first, recall, memorize, project, merge,',
+        '        admit, trip, near, pause, arm, watch, interrupt, abandon, unwound, failed, exhausted, push, Failure, Expired, LET,',
+        '        MASK, TIMEOUT, max_iterations) = runtime',
+        *['    f'+str(index)+' = '+exc for exc, index in constants.items()],
+        '    def run(p, pc):',
+        "        stack = p['s']['stack']",
+        '        budget = max_iterations if max_iterations is not None else -1',
+        *indent(indent(body)),
+        '    return run, '+repr(lets),
+        ''])
+
+def map_chunk(task):
+    ''' apply a function of one argument to a chunk of values, in a worker process of a cpu_map combinator '''
+    code, kind, functionName, chunk = task
+    if kind == 'python:3':
+        scope = {}
+        exec(code, scope)
+        f = scope[functionName]
+    else: # lambda
+        f = types.FunctionType(marshal.loads(base64.b64decode(bytearray(code, 'ASCII'))), {})
+    return [f(value) for value in chunk]
+
+class MemoryStore:
+    ''' memo store keeping the most recently used results in the memory of the container '''
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict() # key -> (result, expiry time or None), least recently used first
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, result, expires):
+        self.entries[key] = (result, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class SQLiteStore:
+    ''' memo store persisting results to a SQLite database file, for compositions run locally '''
+    def __init__(self, database, namespace, max_entries):
+        self.database = database
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.execute('CREATE TABLE IF NOT EXISTS memo '
+            '(namespace TEXT, key TEXT, result TEXT, expires REAL, used INTEGER, PRIMARY KEY (namespace, key))')
+
+    def execute(self, statement, *parameters):
+        db = sqlite3.connect(self.database)
+        try:
+            with db: # commit
+                return db.execute(statement, parameters).fetchall()
+        finally:
+            db.close()
+
+    def get(self, key):
+        rows = self.execute('SELECT result, expires FROM memo WHERE namespace = ? AND key = ?', self.namespace, key)
+        if len(rows) == 0:
+            return None
+        result, expires = rows[0]
+        if expires is not None and expires <= time.time():
+            self.execute('DELETE FROM memo WHERE namespace = ? AND key = ?', self.namespace, key)
+            return None
+        self.execute('UPDATE memo SET used = (SELECT MAX(used) + 1 FROM memo WHERE namespace = ?) WHERE namespace = ? AND key = ?',
+            self.namespace, self.namespace, key)
+        return result
+
+    def put(self, key, result, expires):
+        self.execute('INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(used), 0) + 1 FROM memo WHERE namespace = ?))',
+            self.namespace, key, result, expires, self.namespace)
+        self.execute('DELETE FROM memo WHERE namespace = ? AND key NOT IN '
+            '(SELECT key FROM memo WHERE namespace = ? ORDER BY used DESC LIMIT ?)',
+            self.namespace, self.namespace, self.max_entries)
+
+class FileStore:
+    ''' claim check store keeping large values in the files of a local directory, for compositions run locally '''
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        with open(os.path.join(self.directory, key)) as file:
+            return file.read()
+
+    def put(self, key, value):
+        path = os.path.join(self.directory, key)
+        if not os.path.exists(path): # keys are content hashes
+            with open(path+'.'+str(os.getpid()), 'w') as file:
+                file.write(value)
+            os.replace(path+'.'+str(os.getpid()), path)
+
+def conductor(fsm, max_states=None, max_iterations=None, concurrency=10, workers=None, memo_store='memory', yield_margin=1000,
+        yield_action='/whisk.system/utils/echo', compress_state=8192, claim_check=None, claim_size=65536, claim_secret=None,
+        program=None): # main.
+    wsk = None
+    pool = None
+    processes = None
+    deadline = None # of the current activation in ms since the epoch
+    isObject = lambda x: isinstance(x, dict)
+
+    # runtime stack frames are (kind, value, scope, origin) tuples with the top of the stack last
+    LET, MASK, MARKER, MEMO, TIMEOUT, PROJECT = range(6)
+
+    code, target, arg, path, paths = fsm['code'], fsm['next'], fsm['arg'], fsm['path'], fsm['paths']
+
+    # error handler of each state as a (catch address, stack depth) pair, innermost try block first
+    handler = [None] * len(code)
+    for start, end, catch, depth in sorted(fsm['handlers'], key=lambda block: (block[0], -block[1])):
+        handler[start:end] = [(catch, depth) if catch >= 0 else None] * (end - start)
+
+    # innermost ensure combinator within a timeout body covering each state as a (catch address, stack depth, unwind address) triple
+    finalizer = [None] * len(code)
+    for start, end, catch, depth, finish in sorted(fsm['finalizers'], key=lambda block: (block[0], -block[1])):
+        finalizer[start:end] = [(catch, depth, finish)] * (end - start)
 
     conductor = {}
     operator = lambda f: conductor.setdefault(f.__name__[1:], f)
 
     @operator
-    def _choice(p, node, index, inspect, step):
-        p['s']['state'] = index + (node['then'] if p['params']['value'] else node['else'])
-        return None
-
-    @operator
-    def _try(p, node, index, inspect, step):
-        p['s']['stack'].insert(0, { 'catch': index + node['catch'] })
+    def _choice(p, index):
+        if not p['params']['value']:
+            p['s']['state'] = arg[index]
 
     @operator
-    def _let(p, node, index, inspect, step):
-        p['s']['stack'].insert(0, { 'let': node['let'] }) # JSON.parse(JSON.stringify(jsonv.let))
+    def _let(p, index):
+        if arg[index] is None:
+            push(p['s']['stack'], MASK, None)
+        else:
+            # copy the declarations so that the shared FSM is never mutated by a session
+            push(p['s']['stack'], LET, json.loads(json.dumps(arg[index])), index)
 
     @operator
-    def _exit(p, node, index, inspect, step):
+    def _exit(p, index):
         if len(p['s']['stack']) == 0:
             return internalError('pop from an empty stack')
-        p['s']['stack'].pop(0)
+        p['s']['stack'].pop()
+
+    @operator
+    def _action(p, index):
+        return request(p, arg[index], index)
+
+    @operator
+    def _inline(p, index):
+        perform(p, arg[index]['exec'], arg[index]['name'])
+        inspect_errors(p, index)
+
+    @operator
+    def _function(p, index):
+        evaluate(p, arg[index], paths[path[index]])
+        inspect_errors(p, index)
+
+    @operator
+    def _cpu_map(p, index):
+        offload(p, arg[index]['exec'], arg[index]['chunk'], paths[path[index]])
+        inspect_errors(p, index)
+
+    @operator
+    def _batch(p, index):
+        batch(p, arg[index]['name'], arg[index]['size'], paths[path[index]])
+        inspect_errors(p, index)
+
+    @operator
+    def _empty(p, index):
+        inspect_errors(p, index)
+
+    @operator
+    def _pass(p, index):
+        pass
+
+    @operator
+    def _stop(p, index):
+        p['s']['state'] = -1
+
+    @operator
+    def _async(p, index):
+        entry = p['s']['state']
+        p['s']['state'] = arg[index]
+        fork(p, entry, paths[path[index]])
+        inspect_errors(p, index)
+
+    @operator
+    def _map(p, index):
+        entry = p['s']['state']
+        p['s']['state'] = arg[index]
+        scatter(p, entry, paths[path[index]])
+        inspect_errors(p, index)
+
+    @operator
+    def _memo(p, index):
+        if recall(p, arg[index]):
+            p['s']['state'] = arg[index]['skip']
+            inspect_errors(p, index)
+
+    @operator
+    def _store(p, index):
+        memorize(p, arg[index])
+        inspect_errors(p, index)
+
+    @operator
+    def _project(p, index):
+        project(p, arg[index])
+        inspect_errors(p, index)
+
+    @operator
+    def _merge(p, index):
+        merge(p, arg[index])
+        inspect_errors(p, index)
+
+    @operator
+    def _timeout(p, index):
+        push(p['s']['stack'], TIMEOUT, arm(p, arg[index], index))
+
+    @operator
+    def _unwind(p, index):
+        depth = unwound(p['s']['stack'], index)
+        if depth is not None:
+            unwind(p, depth, index)
+        else:
+            inspect_errors(p, index) # the finalizer ran as usual
+
+    @operator
+    def _breaker(p, index):
+        if not admit(p, arg[index], paths[path[index]]):
+            p['s']['state'] = arg[index]['open']
 
     @operator
-    def _action(p, node, index, inspect, step):
-        return { 'method': 'action', 'action': node['name'], 'params': p['params'], 'state': { '$composer': p['s'] } }
+    def _trip(p, index):
+        trip(p, arg[index], paths[path[index]])
+        inspect_errors(p, index)
 
     @operator
-    def _function(p, node, index, inspect, step):
+    def _parallel(p, index):
+        join(p, arg[index]['branches'], paths[path[index]])
+        inspect_errors(p, index)
+
+    @operator
+    def _race(p, index):
+        first(p, arg[index]['branches'], arg[index]['stagger'], arg[index]['winner'], paths[path[index]])
+        inspect_errors(p, index)
+
+    def request(p, name, state):
+        ''' suspend the current session to invoke action name, resuming at state '''
+        return { 'method': 'action', 'action': name, 'params': p['params'], 'state': { '$composer': save(p['s'], state) } }
+
+    def evaluate(p, exc, where):
+        ''' run function combinator exc at AST path where on the current params '''
         result = None
         try:
-            functionName = node['exec']['functionName'] if 'functionName' in node['exec'] else None
-            result = run(node['exec']['code'], p, node['exec']['kind'], functionName)
+            functionName = exc['functionName'] if 'functionName' in exc else None
+            result = run(exc['code'], p, exc['kind'], functionName)
         except Exception as error:
-            result = { 'error': 'Function combinator threw an exception at AST node root'+node['parent']+' (see log for details)' }
+            result = { 'error': 'Function combinator threw an exception at AST node root'+where+' (see log for details)' }
 
         if callable(result):
-            result = { 'error': 'Function combinator evaluated to a function type at AST node root'+node['parent']}
+            result = { 'error': 'Function combinator evaluated to a function type at AST node root'+where}
 
         # if a function has only side effects and no return value (or return None), return params
         p['params'] = p['params'] if result is None else result
-        inspect_errors(p)
-        return step(p)
-
-    @operator
-    def _empty(p, node, index, inspect, step):
-        inspect_errors(p)
 
-    @operator
-    def _pass(p, node, index, inspect, step):
-        pass
+    def perform(p, exc, name):
+        ''' run inline action name on a copy of the params, its result is the result of an activation '''
+        try:
+            result = load(exc['code'], exc['kind'], exc['functionName'])(json.loads(json.dumps(p['params'])))
+            result = json.loads(json.dumps(result))
+        except Exception as err:
+            print(err)
+            result = { 'error': 'Inline action '+name+' threw an exception (see log for details)' }
+        p['params'] = result if isObject(result) else { 'error': 'Inline action '+name+' did not return a dictionary' }
+
+    def offload(p, exc, chunk, where):
+        ''' apply function combinator exc to every element of the value array, chunk elements per worker process '''
+        nonlocal processes
+
+        values = p['params'].get('value')
+        if not isinstance(values, list):
+            p['params'] = { 'error': 'CPU map combinator expects an array value at AST node root'+where }
+            return
+        tasks = [(exc['code'], exc['kind'], exc.get('functionName'), values[i:i + chunk]) for i in range(0, len(values), chunk)]
+        try:
+            if len(tasks) <= 1: # not worth a round trip to a worker
+                results = [map_chunk(task) for task in tasks]
+            else:
+                if processes is None:
+                    processes = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                results = list(processes.map(map_chunk, tasks))
+            p['params'] = { 'value': [value for result in results for value in result] }
+        except Exception as err:
+            print(err)
+            if isinstance(err, concurrent.futures.process.BrokenProcessPool):
+                processes = None # a worker died, start new ones next time
+            p['params'] = { 'error': 'CPU map combinator threw an exception at AST node root'+where+' (see log for details)' }
 
-    @operator
-    def _async(p, node, index, inspect, step):
+    def fork(p, state, where):
+        ''' spawn a session of the composition entering at state with a copy of the current params '''
         nonlocal wsk
 
-        p['params']['$composer'] = { 'state': p['s']['state'], 'stack': [{ 'marker': True }] + p['s']['stack'] }
-        p['s']['state'] = index + node['return']
+        names = []
+        params = checked(p['params'], names)
+        continuation = { 'v': 2, 'state': state, 'stack': encode(p['s']['stack'] + [(MARKER, None, None, None)]), 'claims': names }
+        params['$composer'] = pack(continuation)
         if wsk is None:
             wsk = openwhisk({ 'ignore_certs': True })
         try:
-            response = wsk.actions.invoke({ 'name': os.getenv('__OW_ACTION_NAME'), 'params': p['params'] })
+            response = wsk.actions.invoke({ 'name': os.getenv('__OW_ACTION_NAME'), 'params': params })
             result = { 'method': 'async', 'activationId': response['activationId'], 'sessionId': p['s']['session'] }
 
         except Exception as err:
             print(err) # invoke failed
-            result = { 'error': 'Async combinator failed to invoke composition at AST node root'+node['parent']+' (see log for details)' }
+            result = { 'error': 'Async combinator failed to invoke composition at AST node root'+where+' (see log for details)' }
 
         p['params'] = result
-        inspect_errors(p)
-        return step(p)
+
+    def executor():
+        ''' thread pool running the sessions spawned by the activations of this container '''
+        nonlocal wsk, pool
+
+        if wsk is None:
+            wsk = openwhisk({ 'ignore_certs': True })
+        if pool is None:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        return pool
+
+    def blocking(name, params):
+        ''' invoke action name on params and wait for its result '''
+        try:
+            result = wsk.actions.invoke({ 'name': name, 'params': params, 'blocking': True, 'result': True })
+        except Exception as err:
+            print(err) # the activation failed or could not be invoked
+            response = getattr(err, 'error', None)
+            valid = isObject(response) and isObject(response.get('response'))
+            result = response['response']['result'] if valid else { 'error': 'invoke failed' }
+        if not isObject(result):
+            result = { 'value': result }
+        return { 'error': result['error'] } if 'error' in result else result
+
+    def session(task):
+        ''' run a session of the composition for an (entry state, params, stack) task and return its result '''
+        state, params, stack = task
+        names = []
+        params = checked(params if isObject(params) else { 'value': params }, names)
+        params['$composer'] = pack({ 'v': 2, 'state': state, 'stack': stack, 'claims': names })
+        return blocking(os.getenv('__OW_ACTION_NAME'), params)
+
+    def gather(p, tasks):
+        ''' run a session for each (entry state, params) task, at most concurrency at a time, results in order '''
+        stack = encode(p['s']['stack'] + [(MARKER, None, None, None)])
+        return list(executor().map(session, [(state, params, stack) for state, params in tasks]))
+
+    # whether actions are annotated as accepting batches, by name
+    batches = {}
+
+    def accepts(name):
+        ''' whether action name declares that it accepts batches, checked once per container '''
+        if name not in batches:
+            try:
+                annotations = wsk.actions.get({ 'name': name }).get('annotations', [])
+            except Exception as err:
+                print(err) # the action could not be fetched, check again next time
+                return False
+            batches[name] = any(annotation.get('key') == 'batch' and annotation.get('value') is True for annotation in annotations)
+        return batches[name]
+
+    def batch(p, name, size, where):
+        ''' invoke action name on { items } batches of size elements of the value array of the params, at most concurrency at a time '''
+        values = p['params'].get('value')
+        if not isinstance(values, list):
+            p['params'] = { 'error': 'Batch combinator expects an array value at AST node root'+where }
+            return
+        pool = executor()
+        if not accepts(name):
+            p['params'] = { 'error': 'Batch combinator requires action '+name+' to be annotated with batch at AST node root'+where }
+            return
+        chunks = [values[i:i + size] for i in range(0, len(values), size)]
+        results = list(pool.map(lambda chunk: blocking(name, { 'items': chunk }), chunks))
+        for index, result in enumerate(results):
+            if 'error' not in result and (not isinstance(result.get('items'), list) or len(result['items']) != len(chunks[index])):
+                results[index] = { 'error': 'Batch action '+name+' must output one item per input item' }
+        if any('error' in result for result in results):
+            collect(p, results, 'Batch combinator failed for {} of {} batches at AST node root'+where)
+        else:
+            p['params'] = { 'value': [item for result in results for item in result['items']] }
+
+    def scatter(p, state, where):
+        ''' run the map body entering at state on every element of the value array of the params '''
+        if not isinstance(p['params'].get('value'), list):
+            p['params'] = { 'error': 'Map combinator expects an array value at AST node root'+where }
+            return
+        results = gather(p, [(state, element) for element in p['params']['value']])
+        collect(p, results, 'Map combinator failed for {} of {} elements at AST node root'+where)
+
+    def join(p, states, where):
+        ''' run the branches of a parallel combinator entering at states on copies of the params '''
+        results = gather(p, [(state, p['params']) for state in states])
+        collect(p, results, 'Parallel combinator failed for {} of {} branches at AST node root'+where)
+
+    def first(p, states, stagger, winner, where):
+        '''
+            run the branches of a race combinator entering at states on copies of the params and
+            output the first successful result, with the index of its branch in field winner if any;
+            each branch starts stagger ms after the previous one, or as soon as all the branches
+            started so far failed
+        '''
+        if len(states) == 0:
+            p['params'] = { 'error': 'Race combinator has no branches at AST node root'+where }
+            return
+        executor() # the client invoking the sessions
+        # a pool of the race's own, shut down without waiting once a branch wins so that the losing
+        # branches still blocked on their invocations neither hold up the race nor the shared pool,
+        # branches beyond concurrency wait for a running one to finish
+        racers = concurrent.futures.ThreadPoolExecutor(max_workers=len(states) if concurrency is None else min(len(states), concurrency))
+        stack = encode(p['s']['stack'] + [(MARKER, None, None, None)])
+        results = [None] * len(states)
+        pending = {}
+        started = 0
+        begin = due = time.time()
+        try:
+            while started < len(states) or len(pending) > 0:
+                if started < len(states) and time.time() >= due:
+                    pending[racers.submit(session, (states[started], p['params'], stack))] = started
+                    started += 1
+                    due = time.time() + stagger / 1000
+                    continue
+                timeout = max(due - time.time(), 0) if started < len(states) else None
+                done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    results[index] = future.result()
+                    if 'error' not in results[index]:
+                        # abandon the other branches, their late results are ignored
+                        print('Race won by branch '+str(index)+' after '+str(int((time.time() - begin) * 1000))+'ms at AST node root'+where)
+                        p['params'] = results[index] if winner is None else dict(results[index], **{ winner: index })
+                        return
+                if len(pending) == 0:
+                    due = time.time() # every branch started so far failed
+        finally:
+            racers.shutdown(wait=False)
+        collect(p, results, 'Race combinator failed for {} of {} branches at AST node root'+where)
+
+    def collect(p, results, message):
+        ''' output the ordered results, or an error listing the failed indices if any '''
+        errors = [index for index, result in enumerate(results) if 'error' in result]
+        if len(errors) > 0:
+            p['params'] = { 'error': { 'message': message.format(len(errors), len(results)), 'errors': errors, 'value': results } }
+        else:
+            p['params'] = { 'value': results }
+
+    def plugin(store):
+        ''' the class of a store option given as a { 'class': name, 'code': source } dictionary '''
+        scope = {}
+        exec(store['code'], scope)
+        return scope[store['class']]
+
+    # memo stores indexed by cache name
+    caches = {}
+
+    def cache(options):
+        ''' store of the memo combinators with the given options '''
+        name = options['cache']
+        if name not in caches:
+            if isObject(memo_store):
+                caches[name] = plugin(memo_store)(name, options['max_entries'])
+            elif memo_store.startswith('sqlite:'):
+                caches[name] = SQLiteStore(memo_store[len('sqlite:'):], name, options['max_entries'])
+            elif memo_store == 'memory':
+                caches[name] = MemoryStore(options['max_entries'])
+            else:
+                raise ValueError('unsupported memo store '+memo_store)
+        return caches[name]
+
+    def recall(p, options):
+        '''
+            output the cached result of a memo combinator for the current params if any, else
+            push a frame recording the key of the params, a hash of their canonical JSON
+        '''
+        params = p['params'] if isObject(p['params']) else { 'value': p['params'] }
+        fields = params if options['key'] is None else { name: params.get(name) for name in options['key'] }
+        key = hashlib.sha256(json.dumps(fields, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+        result = cache(options).get(key)
+        if result is not None:
+            p['params'] = json.loads(result)
+            return True
+        push(p['s']['stack'], MEMO, key)
+        return False
+
+    def memorize(p, options):
+        ''' cache the output of the memo body under the key recorded on the stack, errors only if requested '''
+        key = p['s']['stack'].pop()[1]
+        if failed(p) and not options['cache_errors']:
+            return
+        expires = time.time() + options['ttl'] if options['ttl'] is not None else None
+        cache(options).put(key, json.dumps(p['params']), expires)
+
+    def project(p, fields):
+        '''
+        push a frame saving the params and narrow them to the given fields, dot-separated paths of nested keys,
+        the frame also lists the saved params replaced by claim check references when the session suspends
+        '''
+        if failed(p):
+            return
+        push(p['s']['stack'], PROJECT, { 'params': p['params'], 'claims': [] })
+        projection = {}
+        for field in fields:
+            keys = field.split('.')
+            value = p['params']
+            for key in keys:
+                if not isObject(value) or key not in value:
+                    break # missing fields are left out
+                value = value[key]
+            else:
+                into = projection
+                for key in keys[:-1]:
+                    into = into.setdefault(key, {})
+                into[keys[-1]] = value
+        p['params'] = projection
+
+    def merge(p, fields):
+        '''
+        merge the output of the body of a project combinator into the params saved on the stack,
+        the objects enclosing the projected fields are merged rather than replaced
+        '''
+        frame = p['s']['stack'].pop()[1]
+        if failed(p):
+            return
+        params = frame['params']
+        enclosing = { tuple(keys[:depth]) for keys in (field.split('.') for field in fields) for depth in range(1, len(keys)) }
+
+        def combine(saved, output, path):
+            result = dict(saved)
+            for name, value in output.items():
+                if path + (name,) in enclosing and isObject(value) and isObject(result.get(name)):
+                    value = combine(result[name], value, path + (name,))
+                result[name] = value
+            return result
+
+        try:
+            # only the references issued when saving the params are resolved, other fields are passed through as is
+            p['params'] = combine(dict(params, **{ name: claimed(params[name], True) for name in frame['claims'] }), p['params'], ())
+        except (OSError, ValueError) as err:
+            p['params'] = unclaimed(err)
+
+    # failure statistics of the circuit breakers indexed by name
+    breakers = {}
+
+    def circuit(options):
+        return breakers.setdefault(options['breaker'], { 'failures': collections.deque(), 'opened': None, 'probing': False })
+
+    def admit(p, options, where):
+        '''
+            whether a circuit breaker lets its body run: an open breaker rejects sessions for cooldown seconds
+            then half opens to let a single session probe the body; rejected sessions run the fallback if any
+            or fail
+        '''
+        breaker = circuit(options)
+        if breaker['opened'] is not None:
+            if time.time() < breaker['opened'] + options['cooldown']:
+                if not options['fallback']:
+                    p['params'] = { 'error': 'Circuit breaker open at AST node root'+where }
+                return False
+            breaker['opened'] = time.time() # keep other sessions out while probing
+            breaker['probing'] = True
+        return True
+
+    def trip(p, options, where):
+        ''' record the outcome of a circuit breaker body, opening the breaker after too many recent failures or a failed probe '''
+        breaker = circuit(options)
+        now = time.time()
+        if failed(p):
+            failures = breaker['failures']
+            failures.append(now)
+            while failures[0] <= now - options['window']:
+                failures.popleft()
+            if breaker['probing'] or len(failures) >= options['failures']:
+                print('Circuit breaker opened at AST node root'+where)
+                breaker.update(opened=now, probing=False)
+                failures.clear()
+        elif breaker['probing']:
+            print('Circuit breaker closed at AST node root'+where)
+            breaker.update(opened=None, probing=False)
+
+    def arm(p, options, state):
+        ''' frame of a timeout combinator entered now, with the input params for its fallback and the address of its state if any '''
+        frame = { 'deadline': int(time.time() * 1000) + options['ms'] }
+        if options['fallback']:
+            frame['params'] = p['params']
+        if state is not None:
+            frame['state'] = state
+        return frame
+
+    def expired(stack):
+        ''' depth of the outermost frame of an expired timeout combinator of the current session not running finalizers if any '''
+        now = time.time() * 1000
+        depth = None
+        for index in range(len(stack) - 1, -1, -1):
+            kind, value = stack[index][:2]
+            if kind == MARKER:
+                break # frames of the parent session
+            if kind == TIMEOUT and value['deadline'] <= now and 'unwinding' not in value:
+                depth = index
+        return depth
+
+    def watch(stack):
+        ''' interrupt the generated program if a timeout combinator expired '''
+        depth = expired(stack)
+        if depth is not None:
+            raise Expired(depth)
+
+    def abandon(p, depth, ensure, base, where):
+        '''
+            run the finalizer of the ensure combinator entered at stack depth base on the way out of the body of the expired
+            timeout combinator whose frame is at depth, the frame records the ensure combinator until its finalizer ran
+        '''
+        stack = p['s']['stack']
+        stack[depth][1]['unwinding'] = ensure
+        del stack[base:]
+        p['params'] = { 'error': 'Timeout combinator expired at AST node root'+where }
+
+    def unwound(stack, ensure):
+        ''' depth of the frame of the expired timeout combinator that ran the finalizer of the ensure combinator if any '''
+        for index in range(len(stack) - 1, -1, -1):
+            kind, value = stack[index][:2]
+            if kind == MARKER:
+                break # frames of the parent session
+            if kind == TIMEOUT and value.get('unwinding') == ensure:
+                del value['unwinding']
+                return index
+        return None
+
+    def interrupt(p, depth, where):
+        ''' abandon the body of the expired timeout combinator whose frame is at depth, the fallback runs on its input '''
+        frame = p['s']['stack'][depth][1]
+        del p['s']['stack'][depth:]
+        if 'params' not in frame:
+            p['params'] = { 'error': 'Timeout combinator expired at AST node root'+where }
+            return
+        try:
+            p['params'] = claimed(frame['params']) # set aside by the claim check if the session suspended since
+        except (OSError, ValueError) as err:
+            p['params'] = unclaimed(err)
+
+    def near():
+        ''' whether the current activation is less than yield_margin ms away from its deadline '''
+        return deadline is not None and yield_margin is not None and time.time() * 1000 >= deadline - yield_margin
+
+    def pause(p, state):
+        ''' suspend the current session to resume at state in a fresh activation, by way of the yield action '''
+        print('Yielding before the activation deadline')
+        names = []
+        params = checked(p['params'], names)
+        s = save(p['s'], state, resuming=False, claims=names) # resume at state rather than after it
+        return { 'method': 'action', 'action': yield_action, 'params': params, 'state': { '$composer': s } }
+
+    def push(stack, kind, value, origin=None):
+        '''
+            push a frame together with the scope visible from it, a (parent scope, owners) pair
+            where owners maps every visible symbol to the innermost declarations binding it,
+            and the origin of let frames, the key of their static declarations
+        '''
+        scope = stack[-1][2] if len(stack) > 0 else None
+        if kind == LET:
+            owners = dict(scope[1]) if scope is not None else {}
+            owners.update(dict.fromkeys(value, value))
+            scope = (scope, owners)
+        elif kind == MASK and scope is not None:
+            scope = scope[0] # hide the innermost visible declarations
+        stack.append((kind, value, scope, origin))
+
+    def same(a, b):
+        ''' whether two JSON values are identical, telling booleans, integers and floats apart '''
+        if type(a) is not type(b):
+            return False
+        if isinstance(a, dict):
+            return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+        if isinstance(a, list):
+            return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+        return a == b
+
+    # length of the $composer arrays of each kind of frame, see encode
+    arities = { LET: 3, MASK: 1, MARKER: 1, MEMO: 2, TIMEOUT: 2, PROJECT: 3 }
+
+    def decode(stack, version):
+        ''' convert a $composer stack to a runtime stack, raise ValueError if a frame is malformed or its let no longer exists '''
+        frames = []
+        if version >= 2:
+            # [kind, ...] arrays with the bottom of the stack first, see encode
+            for frame in stack:
+                if not isinstance(frame, list) or len(frame) == 0 or type(frame[0]) is not int or arities.get(frame[0]) != len(frame):
+                    raise ValueError('malformed frame '+json.dumps(frame))
+                if frame[0] == LET and frame[1] is not None:
+                    if type(frame[1]) is not int or frame[1] not in declarations or not isObject(frame[2]):
+                        raise ValueError('let frame of unknown origin '+json.dumps(frame[1]))
+                    value = json.loads(json.dumps(declarations[frame[1]]))
+                    value.update(frame[2])
+                    push(frames, LET, value, frame[1])
+                    continue
+                if frame[0] == PROJECT:
+                    names = frame[2] if isinstance(frame[2], list) else [None]
+                    if not isObject(frame[1]) or any(not isinstance(name, str) or name not in frame[1] for name in names):
+                        raise ValueError('malformed frame '+json.dumps(frame))
+                    push(frames, PROJECT, { 'params': frame[1], 'claims': frame[2] })
+                    continue
+                if frame[0] == LET and not isObject(frame[-1]) or frame[0] == MEMO and not isinstance(frame[1], str):
+                    raise ValueError('malformed frame '+json.dumps(frame))
+                if frame[0] == TIMEOUT and not (isObject(frame[1]) and isinstance(frame[1].get('deadline'), (int, float))):
+                    raise ValueError('malformed frame '+json.dumps(frame))
+                push(frames, frame[0], frame[-1] if frame[0] in (LET, MEMO, TIMEOUT) else None)
+            return frames
+        for frame in reversed(stack):
+            if not isObject(frame):
+                raise ValueError('malformed frame '+json.dumps(frame))
+            if 'catch' in frame:
+                continue # error handlers are static
+            elif 'marker' in frame:
+                push(frames, MARKER, None)
+            elif 'memo' in frame:
+                push(frames, MEMO, frame['memo'])
+            elif 'timeout' in frame:
+                push(frames, TIMEOUT, frame['timeout'])
+            elif frame.get('let') is None and 'let' in frame:
+                push(frames, MASK, None)
+            elif isObject(frame.get('let')):
+                push(frames, LET, frame['let'])
+            else:
+                raise ValueError('malformed frame '+json.dumps(frame))
+        return frames
+
+    def encode(frames):
+        '''
+            convert a runtime stack to a version 2 $composer stack, bottom first, with one array per frame:
+            [LET, origin, changed declarations] or [LET, None, declarations] for let frames of unknown origin,
+            [MASK], [MARKER], [MEMO, key], [TIMEOUT, value] and [PROJECT, params, names of the params replaced by references]
+        '''
+        stack = []
+        for kind, value, _, origin in frames:
+            if kind == LET:
+                if origin is None:
+                    stack.append([LET, None, checked(value)])
+                else:
+                    static = declarations[origin]
+                    stack.append([LET, origin, checked({ name: value[name] for name in value if not same(value[name], static[name]) })])
+            elif kind == TIMEOUT and 'params' in value:
+                stack.append([kind, dict(value, **checked({ 'params': value['params'] }))]) # the input of the fallback
+            elif kind in (MEMO, TIMEOUT):
+                stack.append([kind, value])
+            elif kind == PROJECT:
+                names = list(value['claims']) # references issued by an earlier suspension are kept as is, see checked
+                stack.append([kind, checked(value['params'], names), names])
+            else:
+                stack.append([kind])
+        return stack
+
+    def pack(state, report=False):
+        ''' a $composer state, zlib compressed and base64 encoded if its JSON exceeds compress_state bytes '''
+        text = json.dumps(state, separators=(',', ':'))
+        if compress_state is not None and len(text) > compress_state:
+            packed = { 'v': 2, 'z': base64.b64encode(zlib.compress(text.encode())).decode('ascii') }
+            if report:
+                print('Continuation state of', len(text), 'bytes compressed to', len(packed['z']), 'bytes')
+            return packed
+        if report:
+            print('Continuation state of', len(text), 'bytes')
+        return state
+
+    def unpack(state):
+        ''' inverse of pack '''
+        return json.loads(zlib.decompress(base64.b64decode(state['z']))) if 'z' in state else state
+
+    # claim check store, created on first use
+    claims = None
+    # key signing the claim check references, those of other deployments or clients are not resolved
+    secret = (claim_secret or os.urandom(32).hex()).encode()
+
+    def vault():
+        ''' the claim check store '''
+        nonlocal claims
+        if claims is None:
+            if isObject(claim_check):
+                claims = plugin(claim_check)()
+            elif claim_check.startswith('file:'):
+                claims = FileStore(claim_check[len('file:'):])
+            else:
+                raise ValueError('unsupported claim check store '+claim_check)
+        return claims
+
+    def checked(values, names=None):
+        '''
+        copy of dictionary values where values whose JSON exceeds claim_size bytes are replaced by claim check references,
+        the names of the replaced values are appended to list names if given unless already listed
+        '''
+        if claim_check is None:
+            return dict(values)
+        result = {}
+        for name, value in values.items():
+            if signed(value): # set aside by an earlier suspension, not wrapped again
+                if names is not None and name not in names:
+                    names.append(name)
+                result[name] = value
+                continue
+            text = json.dumps(value, separators=(',', ':'))
+            if len(text) > claim_size:
+                key = hashlib.sha256(text.encode()).hexdigest()
+                vault().put(key, text)
+                value = { '$claim': key, '$mac': hmac.new(secret, key.encode(), hashlib.sha256).hexdigest() }
+                if names is not None and name not in names:
+                    names.append(name)
+            result[name] = value
+        return result
+
+    def signed(value):
+        ''' whether value is a claim check reference issued by this deployment '''
+        if not isObject(value) or value.keys() != { '$claim', '$mac' }:
+            return False
+        if not isinstance(value['$claim'], str) or not isinstance(value['$mac'], str):
+            return False
+        return hmac.compare_digest(value['$mac'], hmac.new(secret, value['$claim'].encode(), hashlib.sha256).hexdigest())
+
+    def claimed(value, required=False):
+        '''
+        the value referenced by a claim check reference issued by this deployment, any other value unchanged
+        unless required, then raise ValueError
+        '''
+        if claim_check is None:
+            return value
+        if signed(value):
+            return json.loads(vault().get(value['$claim']))
+        if required:
+            raise ValueError('invalid claim check reference '+json.dumps(value))
+        return value
+
+    def unclaimed(err):
+        ''' error result for a claim check reference that could not be resolved '''
+        print(err)
+        return { 'error': 'Claim check reference could not be resolved (see log for details)' }
+
+    def save(s, index, resuming=True, claims=None):
+        '''
+        $composer state for the continuation of the current session after the action at index,
+        claims lists the params replaced by claim check references to restore on resumption
+        '''
+        state = { 'v': 2, 'state': index, 'stack': encode(s['stack']), 'session': s['session'] }
+        if resuming:
+            state['resuming'] = True
+        if claims:
+            state['claims'] = claims
+        return pack(state, report=True)
 
     def finish(q):
         return q['params'] if 'error' in q['params'] else { 'params': q['params'] }
@@ -319,92 +1737,162 @@ def conductor(composition): # main.
     #badRequest = lambda error: { 'code': 400, 'error': error }
     internalError = lambda error: encodeError(error)
 
-    def inspect_errors(p):
+    def failed(p):
+        ''' wrap non-object params and report errors, discarding all fields but the error field '''
         if not isObject(p['params']):
             p['params'] = { 'value': p['params'] }
         if 'error' in p['params']:
-            p['params'] = { 'error': p['params']['error'] } # discard all fields but the error field
-            p['s']['state'] = -1 # abort unless there is a handler in the stack
-            while len(p['s']['stack']) > 0 and 'marker' not in p['s']['stack'][0]:
-                first = p['s']['stack'][0]
-                p['s']['stack'] = p['s']['stack'][1:]
-                if 'catch' in first:
-                    p['s']['state'] = first['catch']
-                    if p['s']['state'] >= 0:
-                        break
-
-    def reduceRight(func, init, seq):
-        if not seq:
-            return init
-        else:
-            return func(reduceRight(func, init, seq[1:]), seq[0])
-
-    def update(dict, dict2):
-        dict.update(dict2)
-        return dict
+            p['params'] = { 'error': p['params']['error'] }
+            return True
+        return False
+
+    def inspect_errors(p, index):
+        if failed(p):
+            p['s']['state'] = -1 # abort unless the state at index has a handler
+            if 0 <= index < len(handler) and handler[index] is not None:
+                p['s']['state'], depth = handler[index]
+                del p['s']['stack'][depth:]
+
+    # compiled functions indexed by (kind, function name, code), each with its own globals
+    functions = {}
+
+    def load(f, kind, functionName=None):
+        ''' compile function f once per container '''
+        key = (kind, functionName, f)
+        if key not in functions:
+            if kind == 'python:3':
+                scope = {}
+                exec(f, scope)
+                functions[key] = scope[functionName]
+            else: # lambda
+                functions[key] = types.FunctionType(marshal.loads(base64.b64decode(bytearray(f, 'ASCII'))), {})
+        return functions[key]
 
     # run function f on current stack
     def run(f, p, kind, functionName=None):
-        # handle let/mask pairs
-        view = []
-        n = 0
-        for frame in p['s']['stack']:
-            if 'let' in frame and frame['let'] is None:
-                n += 1
-            elif 'let' in frame:
-                if n == 0:
-                    view.append(frame)
-                else:
-                    n -= 1
-        # update value of topmost matching symbol on stack if any
-        def set(symbol, value):
-            lets = [element for element in view if 'let' in element and symbol in element['let']]
-            if len(lets) > 0:
-                element = lets[0]
-                element['let'][symbol] = value # TODO: JSON.parse(JSON.stringify(value))
-
-        # collapse stack for invocation
-        env = reduceRight(lambda acc, cur: update(acc, cur['let']) if 'let' in cur and isinstance(cur['let'], dict) else acc, {}, view)
-        if kind == 'python:3':
-            main = '''exec(code + "\\n__out__['value'] = ''' + functionName + '''(env, args)", {'env': env, 'args': args, '__out__':__out__})'''
-            code = f
-        else: # lambda
-            main = '''__out__['value'] = code(env, args)'''
-            code = types.FunctionType(marshal.loads(base64.b64decode(bytearray(f, 'ASCII'))), {})
+        code = load(f, kind, functionName)
 
+        # collapse the visible declarations for invocation
+        stack = p['s']['stack']
+        owners = stack[-1][2][1] if len(stack) > 0 and stack[-1][2] is not None else {}
+        env = { name: claimed(owner[name]) for name, owner in owners.items() }
         try:
-            out = {'value': None}
-            exec(main, {'env': env, 'args': p['params'], 'code': code, '__out__': out})
-            return out['value']
+            return code(env, p['params'])
         finally:
-            for name in env:
-                set(name, env[name])
-
-    def step(p):
-        # final state, return composition result
-        if p['s']['state'] < 0 or p['s']['state'] >= len(fsm):
+            # update the innermost binding of the symbols that were assigned
+            for name, owner in owners.items():
+                if name in env and env[name] is not owner[name]:
+                    owner[name] = env[name]
+
+    def unexpected(name):
+        return lambda p, index: internalError('unexpected '+name+' combinator')
+
+    # operator of each opcode
+    dispatch = [conductor.get(name, unexpected(name)) for name in fsm['opcodes']]
+
+    # deadlines are only checked if the composition has timeout combinators
+    timed = fsm['opcodes'].index('timeout') in code if 'timeout' in fsm['opcodes'] else False
+
+    def unwind(p, depth, previous):
+        '''
+            leave the body of the expired timeout combinator whose frame is at depth after running the state at address previous,
+            running the finalizer of the innermost ensure combinator whose body covers this state if any, else the fallback
+        '''
+        timer = p['s']['stack'][depth][1]['state']
+        pending = finalizer[previous] if previous is not None and 0 <= previous < len(code) else None
+        if pending is not None and pending[1] > depth:
+            catch, base, finish = pending
+            abandon(p, depth, finish, base, paths[path[timer]])
+            p['s']['state'] = catch
+        else:
+            interrupt(p, depth, paths[path[timer]])
+            p['s']['state'] = arg[timer]['expire']
+
+    def step(p, previous=None):
+        # run states until the composition suspends or reaches its final state,
+        # previous is the last state run, the action whose result resumes the session if any
+        s = p['s']
+        budget = max_iterations
+        states = max_states
+        while True:
+            index = s['state']
+            # final state, return composition result
+            if index < 0 or index >= len(code):
+                print('Entering final state')
+                print(json.dumps(p['params']))
+                return None
+
+            if states is not None:
+                if states <= 0:
+                    return internalError('exceeded the maximum number of states per activation ('+str(max_states)+')')
+                states -= 1
+
+            if timed:
+                depth = expired(s['stack'])
+                if depth is not None:
+                    unwind(p, depth, previous)
+                    continue
+
+            # a jump back starts a new loop iteration, where the budget is spent and the session yields
+            # after making progress if the activation is about to be killed
+            if previous is not None and index <= previous:
+                if budget is not None:
+                    if budget <= 0:
+                        return exhausted()
+                    budget -= 1
+                if near():
+                    return pause(p, index)
+            previous = index
+
+            # process one state
+            s['state'] = target[index]
+            result = dispatch[code[index]](p, index)
+            if result is not None:
+                return result
+
+
+    class Failure(Exception):
+        ''' raised by the generated program when the params are an error '''
+
+    class Expired(Exception):
+        ''' raised by the generated program when the timeout combinator whose frame is at depth expired '''
+        def __init__(self, depth):
+            super().__init__(depth)
+            self.depth = depth
+
+    exhausted = lambda: internalError('exceeded the maximum number of loop iterations per activation ('+str(max_iterations)+')')
+
+    if program is not None:
+        program, declarations = program((evaluate, perform, offload, batch, request, fork, scatter, join, first, recall, memorize,
+            project, merge, admit, trip, near, pause, arm, watch, interrupt, abandon, unwound, failed, exhausted, push, Failure, Expired,
+            LET, MASK, TIMEOUT, max_iterations))
+        declarations = dict(enumerate(declarations))
+    else:
+        # static declarations of let states, the origins of let frames
+        declarations = { index: arg[index] for index in range(len(code))
+            if fsm['opcodes'][code[index]] == 'let' and arg[index] is not None }
+
+    def execute(p):
+        # run the generated program until the composition suspends or completes
+        try:
+            result = program(p, p['s']['state'])
+        except Failure: # no handler, the params are the error of the composition
+            result = None
+        if result is None:
             print('Entering final state')
             print(json.dumps(p['params']))
-            return None
-
-        # process one state
-        node = fsm[p['s']['state']] # json definition for current state
-        if 'path' in node:
-            print('Entering composition'+node['path'])
-        index = p['s']['state']
-        p['s']['state'] = p['s']['state'] + node.get('next', 1)
-        if not callable(conductor[node['type']]):
-            return internalError('unexpected '+node['type']+' combinator')
-
-        result = conductor[node['type']](p, node, index, inspect, step)
-        return result if result is not None else step(p)
-
+        return result
 
     def invoke(params):
         ''' do invocation '''
-        pcomposer = params.get('$composer', {})
+        nonlocal deadline
+        deadline = int(os.getenv('__OW_DEADLINE')) if os.getenv('__OW_DEADLINE') else None
+
+        pcomposer = unpack(params.get('$composer', {}))
         if '$composer' in params:
             del params['$composer']
+        version = pcomposer.pop('v', 1 if len(pcomposer) > 0 else 2) # fresh sessions have no state to convert
+        claims = pcomposer.pop('claims', []) # params replaced by claim check references when suspending or spawning the session
         pcomposer['session'] = pcomposer.get('session', os.getenv('__OW_ACTIVATION_ID'))
 
         # current state
@@ -416,13 +1904,49 @@ def conductor(composition): # main.
             return internalError('state parameter is not a number')
         if not isinstance(p['s']['stack'], list):
             return internalError('stack parameter is not an array')
-
-        if 'resuming' in pcomposer:
-            inspect_errors(p) # handle error objects when resuming
+        try:
+            if version < 2:
+                # the state of an older conductor is the next state to run in the unoptimized FSM and its error handlers are on the stack
+                if 'legacy' not in fsm:
+                    return internalError('continuation state of an older conductor cannot be resumed by the python backend')
+                stack = p['s']['stack']
+                if 'resuming' in pcomposer and failed(p):
+                    p['s']['state'] = -1 # abort unless there is a handler in the stack
+                    while len(stack) > 0:
+                        if not isObject(stack[0]) or type(stack[0].get('catch', 0)) is not int:
+                            raise ValueError('malformed frame '+json.dumps(stack[0]))
+                        if 'marker' in stack[0]:
+                            break
+                        first = stack.pop(0)
+                        if 'catch' in first and first['catch'] >= 0:
+                            p['s']['state'] = first['catch']
+                            break
+                if 0 <= p['s']['state'] < len(fsm['legacy']):
+                    p['s']['state'] = fsm['legacy'][p['s']['state']]
+            p['s']['stack'] = decode(p['s']['stack'], version)
+        except ValueError as err:
+            print(err) # stale state of an earlier deployment or forged state
+            return internalError('State could not be decoded')
+
+        if claim_check is not None and isinstance(claims, list):
+            try:
+                claims = [name for name in claims if isinstance(name, str) and name in params]
+                p['params'] = dict(params, **{ name: claimed(params[name], True) for name in claims })
+            except (OSError, ValueError) as err:
+                p['params'] = unclaimed(err)
+                return finish(p)
+
+        resumed = None
+        if 'resuming' in pcomposer and version >= 2 and program is None:
+            # handle error objects when resuming, the state is the action that produced the params
+            resumed = p['s']['state']
+            if 0 <= resumed < len(code):
+                p['s']['state'] = target[resumed]
+            inspect_errors(p, resumed)
 
         result = None
         try:
-            result = step(p)
+            result = step(p, resumed) if program is None else execute(p)
         except Exception as err:
             p['params'] = {'error': internalError(err)}
 
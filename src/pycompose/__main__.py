@@ -26,6 +26,7 @@ def main():
     parser.add_argument('file', metavar='composition', type=str, help='the composition')
     parser.add_argument('-v', '--version', action='version', version='%(prog)s '+ composer.__version__)
     parser.add_argument('--ast', action='store_true', help='output ast')
+    parser.add_argument('--fuse', action='store_true', help='fuse runs of consecutive actions into native sequences')
 
     args = parser.parse_args()
 
@@ -40,7 +41,7 @@ def main():
         exec(main, {'code': source, '__out__': out})
 
         composition = out['value']
-        composition = composition.compile()
+        composition = composition.compile(fuse=args.fuse)
 
         if args.ast:
             composition = composition['ast']
@@ -88,6 +88,11 @@ def main():
         action="store_true",
         help="overwrite actions if already defined",
     )
+    parser.add_argument(
+        "--inline",
+        action="store_true",
+        help="inline the compositions referenced by name",
+    )
 
     args = parser.parse_args()
 
@@ -155,12 +160,12 @@ def main():
 
     try:
         actions = conductor.openwhisk(options).compositions.deploy(
-            composition, args.overwrite
+            composition, args.overwrite, args.inline
         )
         names = " ".join([n["name"] for n in actions])
         print("ok: created action" + ("s" if len(names) > 1 else "") + "" + names)
     except Exception as err:
-        print(err.error)
+        print(getattr(err, "error", err))
         sys.exit(500 - 256)
 
 
@@ -19,6 +19,7 @@ import composer
 import conductor
 import pytest
 import os
+import json
 
 name = 'TestAction'
 
@@ -33,12 +34,22 @@ def define(action):
     wsk.actions.create(action)
 
 
-def invoke(composition, params = {}, blocking = True):
+# conductor backend of the compositions deployed by invoke
+backend = 'fsm'
+
+@pytest.fixture(params=['fsm', 'python'])
+def each_backend(request):
+    ''' run a test deploying compositions with each conductor backend '''
+    global backend
+    backend = request.param
+
+def invoke(composition, params = {}, blocking = True, options = None, fuse = False):
    ''' deploy and invoke composition '''
 
    try:
        extended = { 'name': name }
-       extended.update(composition.compile())
+       extended.update(composition.compile(fuse))
+       extended['conductor'] = dict({ 'backend': backend }, **(options or {}))
        wsk.compositions.deploy(extended, True)
        return wsk.actions.invoke({ 'name': name, 'params': params, 'blocking': blocking })
    except Exception as err:
@@ -64,6 +75,9 @@ def set_else_true(env, args):
 def dec_n(env, args):
     return {'n': args['n'] - 1 }
 
+def is_positive(env, args):
+    return args['n'] > 0
+
 def cond_false(env, args):
     return False
 
@@ -97,6 +111,34 @@ def get_value_plus_x(env, args):
 def noop(env, args):
     pass
 
+def inc_x(env, args):
+    env['x'] += 1
+
+def inc_n(args):
+    return { 'n': args['n'] + 1 }
+
+class NoStore:
+    ''' memo store that never hits '''
+    def __init__(self, name, max_entries):
+        pass
+
+    def get(self, key):
+        return None
+
+    def put(self, key, result, expires):
+        pass
+
+class TmpStore:
+    ''' claim check store keeping values in files of /tmp '''
+    def get(self, key):
+        with open('/tmp/claim-'+key) as file:
+            return file.read()
+
+    def put(self, key, text):
+        with open('/tmp/claim-'+key, 'w') as file:
+            file.write(text)
+
+@pytest.mark.usefixtures('each_backend')
 class TestBlockingInvocations:
     def test_action_true(self):
         ''' action must return true '''
@@ -113,8 +155,119 @@ class TestBlockingInvocations:
         activation = invoke(composer.asynchronous('isNotOne'), { 'n': 1 }, False)
         assert 'activationId' in activation
 
+    def test_inline(self):
+        double = composer.action('double', { 'action': lambda args: { 'n': args['n'] * 2 }, 'inline': True })
+        composition = composer.sequence(composer.action('inc', { 'action': inc_n, 'inline': True }), double)
+        assert 'actions' not in composition.compile()
+        activation = invoke(composition, { 'n': 1 })
+        assert activation['response']['result'] == { 'n': 4 }
 
-    def test_parse_action_name(self):
+    def test_inline_error(self):
+        try:
+            invoke(composer.action('fail', { 'action': lambda args: 1 / 0, 'inline': True }), { 'n': 1 })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error'].startswith('Inline action /_/fail threw an exception')
+
+    def test_inline_same_code(self):
+        code = 'def first(args):\n    return { "f": 1 }\n\ndef second(args):\n    return { "f": 2 }\n'
+        activation = invoke(composer.sequence(
+            composer.action('first', { 'action': { 'kind': 'python:3', 'code': code, 'main': 'first' }, 'inline': True }),
+            composer.action('second', { 'action': { 'kind': 'python:3', 'code': code, 'main': 'second' }, 'inline': True })))
+        assert activation['response']['result'] == { 'f': 2 }
+
+class TestCompile:
+
+    def test_sequence(self):
+        fsm = conductor.compile_fsm(composer.sequence('isNotOne', 'isEven').compile()['composition'])
+        assert [fsm['opcodes'][code] for code in fsm['code']] == ['pass', 'action', 'action']
+        assert fsm['arg'] == [None, '/_/isNotOne', '/_/isEven']
+        assert fsm['next'] == [1, 2, 3]
+
+    def test_handlers(self):
+        fsm = conductor.compile_fsm(composer.do('isNotOne', 'isEven').compile()['composition'])
+        assert [fsm['opcodes'][code] for code in fsm['code']] == ['pass', 'action', 'pass', 'action', 'pass']
+        assert fsm['next'] == [1, 2, 4, 4, 5]
+        assert fsm['handlers'] == [[1, 2, 3, 0]]
+
+    def test_paths(self):
+        fsm = conductor.compile_fsm(composer.when('isEven', 'isNotOne').compile()['composition'])
+        assert len(fsm['paths']) == len(set(fsm['paths']))
+        assert [fsm['paths'][path] for path in fsm['path']][0] == ''
+
+    def test_optimize_sequence(self):
+        fsm, removed = conductor.optimize_fsm(conductor.compile_fsm(composer.sequence('isNotOne', 'isEven').compile()['composition']))
+        assert removed == 1
+        assert [fsm['opcodes'][code] for code in fsm['code']] == ['action', 'action']
+        assert fsm['next'] == [1, 2]
+
+    def test_optimize_handlers(self):
+        fsm, removed = conductor.optimize_fsm(conductor.compile_fsm(composer.do('isNotOne', 'isEven').compile()['composition']))
+        assert removed == 3
+        assert fsm['next'] == [2, 2]
+        assert fsm['handlers'] == [[0, 1, 1, 0]]
+
+    def test_fuse(self):
+        composition = composer.sequence('isNotOne', 'isEven', composer.function(isEven), 'DivideByTwo').compile(fuse=True)
+        assert [component.type for component in composition['composition'].components] == ['action', 'function', 'action']
+        assert composition['actions'][0]['name'] == composition['composition'].components[0].name
+        assert composition['actions'][0]['action']['exec'] == { 'kind': 'sequence', 'components': ('/_/isNotOne', '/_/isEven') }
+
+    def test_composition(self):
+        fsm = conductor.compile_fsm(composer.composition('isNotOne').compile()['composition'])
+        assert [fsm['opcodes'][code] for code in fsm['code']] == ['action']
+        assert fsm['arg'] == ['/_/isNotOne']
+
+    def test_inline_composition(self):
+        child = composer.let({ 'x': 42 }, 'isNotOne', 'isEven')
+        resolve = lambda name: child if name == '/_/child' else None
+        composition = composer.let({ 'x': 0 }, composer.composition('child'), composer.composition('other')).compile(resolve=resolve)
+        components = composition['composition'].components
+        assert [component.type for component in components] == ['mask', 'composition']
+        assert components[0].components[0].type == 'let'
+
+    def test_resolve(self):
+        child = { 'name': 'child', 'annotations': [], 'limits': {} }
+        child.update(json.loads(json.dumps(composer.let({ 'x': 42 }, 'isNotOne').compile(), default=composer.serialize)))
+        annotations = conductor.synthesize(child)['action']['annotations']
+        class Actions:
+            def get(self, options):
+                if options['name'] != '/_/child':
+                    raise Exception('The requested resource does not exist.')
+                return { 'annotations': annotations }
+        class Client:
+            actions = Actions()
+        compositions = conductor.conductor.Compositions(Client())
+        assert compositions.resolve('/_/child').type == 'let'
+        assert compositions.resolve('/_/missing') is None
+
+    @pytest.mark.usefixtures('each_backend')
+    def test_synthesize(self):
+        composition = { 'name': name, 'annotations': [], 'limits': {}, 'conductor': { 'backend': backend } }
+        composition.update(composer.let({ 'x': 3 }, composer.repeat(4, inc_x), get_x).compile())
+        scope = {}
+        exec(conductor.synthesize(composition)['action']['exec']['code'], scope)
+        assert scope['main']({}) == { 'params': { 'value': 7 } }
+
+    def test_program_fallback(self, monkeypatch):
+        composition = { 'name': name, 'annotations': [], 'limits': {}, 'conductor': { 'backend': 'python' } }
+        body = noop
+        for _ in range(25):
+            body = composer.loop(cond_false, body)
+        composition.update(body.compile())
+        assert 'program=program' not in conductor.synthesize(composition)['action']['exec']['code'] # too deeply nested
+        monkeypatch.setattr(conductor.conductor, 'compile_program', lambda composition: 'def program(:\n')
+        with pytest.raises(SyntaxError):
+            conductor.synthesize(composition)
+
+    def test_program(self):
+        program = conductor.compile_program(composer.loop(is_positive, composer.do('DivideByTwo', noop)).compile()['composition'])
+        compile(program, 'program', 'exec')
+
+class TestArguments:
+    ''' validation of the combinator arguments, without deploying compositions '''
+
+    def test_action_parse_action_name(self):
         combos = [
             { "n": 42, "s": False, "e": "Name must be a string" },
             { "n": "", "s": False, "e": "Name is not valid" },
@@ -144,14 +297,113 @@ class TestBlockingInvocations:
                 except composer.ComposerError as error:
                     assert error.message == combo["e"]
 
-    def test_invalid(self):
+    def test_action_invalid(self):
         '''invalid options'''
         try:
-            invoke(composer.action('foo', 42))
+            composer.action('foo', 42)
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_action_inline_invalid(self):
+        try:
+            composer.action('foo', { 'action': { 'kind': 'nodejs:default', 'code': 'function main() {}' }, 'inline': True })
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_literal_invalid_arg(self):
+        try:
+            composer.literal(lambda x:x)
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_let_invalid_argument(self):
+        try:
+            composer.let(invoke)
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_repeat_invalid_argument(self) :
+        try:
+            composer.repeat('foo')
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_race_invalid_winner(self):
+        try:
+            composer.race('DivideByTwo', winner=1)
             assert False
         except composer.ComposerError as error:
             assert error.message.startswith('Invalid argument')
 
+    def test_reduce_invalid_arity(self):
+        try:
+            composer.reduce(lambda env, args: sum(args['value']), arity=1).compile()
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_cpu_map_env(self):
+        try:
+            composer.cpu_map(lambda env, args: args)
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_memo_invalid_argument(self):
+        try:
+            composer.memo('echo', key='n')
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_batch_invalid_argument(self):
+        try:
+            composer.batch('DivideByTwo', size=0)
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_batch_definition(self):
+        action = composer.action('double', { 'action': lambda args: { 'items': [2 * item for item in args['items']] }, 'batch': True })
+        composition = composer.batch(action, size=10).compile()
+        assert composition['composition'].name == '/_/double'
+        assert composition['actions'][0]['name'] == '/_/double'
+        assert composition['actions'][0]['action']['annotations'] == [{ 'key': 'batch', 'value': True }]
+
+    def test_project_invalid_argument(self):
+        try:
+            composer.project('n', 'DivideByTwo')
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_timeout_invalid_argument(self):
+        try:
+            composer.timeout('foo', 'DivideByTwo')
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_breaker_invalid_argument(self):
+        try:
+            composer.breaker('echo', cooldown=0)
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+    def test_retry_invalid_argument(self) :
+        try:
+            composer.retry('foo')
+            assert False
+        except composer.ComposerError as error:
+            assert error.message.startswith('Invalid argument')
+
+@pytest.mark.usefixtures('each_backend')
 class TestLiteral:
 
     def test_boolean(self):
@@ -162,13 +414,7 @@ class TestLiteral:
         activation = invoke(composer.literal(42))
         assert activation['response']['result'] == { 'value': 42 }
 
-    def test_invalid_arg(self):
-        try:
-            composer.literal(lambda x:x)
-            assert False
-        except composer.ComposerError as error:
-            assert error.message.startswith('Invalid argument')
-
+@pytest.mark.usefixtures('each_backend')
 class TestFunction:
 
     def test_function_true(self):
@@ -179,6 +425,7 @@ class TestFunction:
          activation = invoke(composer.function(lambda env, args: args['n'] % 2 == 0), { 'n': 4 })
          assert activation['response']['result'] == { 'value': True }
 
+@pytest.mark.usefixtures('each_backend')
 class TestTasks:
 
     def test_task_action(self):
@@ -201,6 +448,7 @@ class TestTasks:
         except Exception as error:
             print(error)
 
+@pytest.mark.usefixtures('each_backend')
 class TestSequence:
 
     def test_flat(self):
@@ -219,6 +467,43 @@ class TestSequence:
         activation = invoke(composer.seq('TripleAndIncrement', 'DivideByTwo', 'DivideByTwo'), { 'n': 5 })
         assert activation['response']['result'] == { 'n': 4 }
 
+    def test_fused(self):
+        activation = invoke(composer.seq('TripleAndIncrement', 'DivideByTwo', 'DivideByTwo'), { 'n': 5 }, fuse=True)
+        assert activation['response']['result'] == { 'n': 4 }
+
+    def test_fused_shared(self):
+        # compositions fusing the same actions share a sequence, deployed once
+        for composition_name in ['TestFusedA', 'TestFusedB']:
+            extended = { 'name': composition_name, 'annotations': [], 'limits': {} }
+            extended.update(composer.seq('TripleAndIncrement', 'DivideByTwo').compile(True))
+            try:
+                wsk.actions.delete(composition_name)
+            except Exception:
+                pass
+            wsk.compositions.deploy(extended, False)
+            activation = wsk.actions.invoke({ 'name': composition_name, 'params': { 'n': 5 }, 'blocking': True })
+            assert activation['response']['result'] == { 'n': 8 }
+
+    def test_fused_error(self):
+        failing = composer.action('failing', { 'action': lambda args: { 'error': 'foo' } })
+        composition = composer.do(composer.seq('TripleAndIncrement', failing, 'DivideByTwo'), lambda env, args: { 'caught': args['error'] })
+        activation = invoke(composition, { 'n': 5 }, fuse=True)
+        assert activation['response']['result'] == { 'caught': 'foo' }
+
+@pytest.mark.usefixtures('each_backend')
+class TestComposition:
+
+    def test_inline(self):
+        child = { 'name': 'TestChild', 'annotations': [], 'limits': {} }
+        child.update(composer.sequence('TripleAndIncrement', 'DivideByTwo').compile())
+        wsk.compositions.deploy(child, True)
+        extended = { 'name': name, 'annotations': [], 'limits': {} }
+        extended.update(composer.sequence(composer.composition('TestChild'), 'DivideByTwo').compile())
+        wsk.compositions.deploy(extended, True, True)
+        activation = wsk.actions.invoke({ 'name': name, 'params': { 'n': 5 }, 'blocking': True })
+        assert activation['response']['result'] == { 'n': 4 }
+
+@pytest.mark.usefixtures('each_backend')
 class TestIf:
     def test_condition_true(self):
         activation = invoke(composer.when('isEven', 'DivideByTwo', 'TripleAndIncrement'), { 'n': 4 })
@@ -244,6 +529,7 @@ class TestIf:
         activation = invoke(composer.when_nosave('isEven', set_then_true, set_else_true), { 'n': 3 })
         assert activation['response']['result'] == { 'value': False, 'else': True }
 
+@pytest.mark.usefixtures('each_backend')
 class TestLoop:
 
     def test_a_few_iterations(self) :
@@ -258,6 +544,29 @@ class TestLoop:
         activation = invoke(composer.loop_nosave(cond_nosave, dec_n), { 'n': 4 })
         assert activation['response']['result'] == { 'value': False, 'n': 1 }
 
+    def test_many_iterations(self):
+        activation = invoke(composer.loop(is_positive, dec_n), { 'n': 2000 })
+        assert activation['response']['result'] == { 'n': 0 }
+
+    def test_max_iterations(self):
+        activation = invoke(composer.loop(is_positive, dec_n), { 'n': 100 }, options={ 'max_iterations': 100 })
+        assert activation['response']['result'] == { 'n': 0 }
+        try:
+            invoke(composer.loop(is_positive, dec_n), { 'n': 101 }, options={ 'max_iterations': 100 })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error'].startswith('exceeded the maximum number of loop iterations')
+
+    def test_max_states(self):
+        activation = invoke(composer.sequence(dec_n, dec_n, dec_n), { 'n': 3 }, options={ 'max_states': 3 })
+        assert activation['response']['result'] == { 'n': 0 }
+        try:
+            invoke(composer.sequence(dec_n, dec_n, dec_n), { 'n': 3 }, options={ 'max_states': 2 })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error'].startswith('exceeded the maximum number of states')
+
+@pytest.mark.usefixtures('each_backend')
 class TestDoLoop:
 
     def test_a_few_iterations(self) :
@@ -272,6 +581,7 @@ class TestDoLoop:
         activation = invoke(composer.doloop_nosave(dec_n, cond_nosave), { 'n': 4 })
         assert activation['response']['result'] == { 'value': False, 'n': 1 }
 
+@pytest.mark.usefixtures('each_backend')
 class TestDo: # Try
     def test_no_error(self):
         activation = invoke(composer.do(cond_true, return_error_message), {})
@@ -297,6 +607,7 @@ class TestDo: # Try
         activation = invoke(composer.retain(composer.do(set_p_4, None)), { 'n': 3 })
         assert activation['response']['result'] == { 'params': { 'n': 3 }, 'result': { 'p': 4 } }
 
+@pytest.mark.usefixtures('each_backend')
 class TestEnsure: # Finally
 
     def test_no_error(self) :
@@ -307,6 +618,7 @@ class TestEnsure: # Finally
         activation = invoke(composer.ensure(set_error, nest_params), {})
         assert activation['response']['result'] == { 'params': { 'error': 'foo' } }
 
+@pytest.mark.usefixtures('each_backend')
 class TestLet:
 
     def test_one_variable(self) :
@@ -329,13 +641,46 @@ class TestLet:
         activation = invoke(composer.let({ 'x': 42 }, composer.let({ 'x': 69 }, get_x), get_value_plus_x), {})
         assert activation['response']['result'] == { 'value': 111 }
 
-    def test_invalid_argument(self):
-        try:
-            invoke(composer.let(invoke))
-            assert False
-        except composer.ComposerError as error:
-            assert error.message.startswith('Invalid argument')
-
+    def test_reentry(self) :
+        activation = invoke(composer.repeat(2, composer.let({ 'x': 0 }, inc_x, get_x)), {})
+        assert activation['response']['result'] == { 'value': 1 }
+
+    def test_suspension(self) :
+        for options in ({}, { 'compress_state': 0 }):
+            composition = composer.let({ 'x': 0, 'y': 69 }, inc_x, 'DivideByTwo', inc_x, 'DivideByTwo', get_x_plus_y)
+            activation = invoke(composition, { 'n': 4 }, options=options)
+            assert activation['response']['result'] == { 'value': 71 }
+
+    def test_legacy_state(self) :
+        # continuation states saved by an older conductor once the first action of the composition has run
+        composition = composer.sequence('TripleAndIncrement', 'DivideByTwo')
+        if backend == 'python':
+            try:
+                invoke(composition, { 'n': 10, '$composer': { 'state': 2, 'stack': [], 'resuming': True } })
+                assert False
+            except Exception as err:
+                assert err.error['response']['result']['error'].startswith('continuation state of an older conductor cannot be resumed')
+            return
+        activation = invoke(composition, { 'n': 10, '$composer': { 'state': 2, 'stack': [], 'resuming': True } })
+        assert activation['response']['result'] == { 'n': 5 }
+        composition = composer.let({ 'x': 2 }, 'TripleAndIncrement', lambda env, args: { 'n': args['n'] * env['x'] })
+        activation = invoke(composition, { 'n': 10, '$composer': { 'state': 2, 'stack': [{ 'let': { 'x': 2 } }], 'resuming': True } })
+        assert activation['response']['result'] == { 'n': 20 }
+        composition = composer.do(composer.sequence('TripleAndIncrement', 'DivideByTwo'), lambda env, args: { 'caught': args['error'] })
+        activation = invoke(composition, { 'error': 'foo', '$composer': { 'state': 3, 'stack': [{ 'catch': 5 }], 'resuming': True } })
+        assert activation['response']['result'] == { 'caught': 'foo' }
+
+    def test_undecodable_state(self):
+        composition = composer.let({ 'x': 2 }, 'TripleAndIncrement', lambda env, args: { 'n': args['n'] * env['x'] })
+        # a let that no longer exists after a redeployment, an unknown kind of frame and a frame of the wrong arity
+        for stack in [[[0, 99, {}]], [[42]], [[0, 0]], [{ 'memo': 'key' }]]:
+            try:
+                invoke(composition, { 'n': 10, '$composer': { 'v': 2, 'state': 1, 'stack': stack } })
+                assert False
+            except Exception as err:
+                assert err.error['response']['result']['error'] == 'State could not be decoded'
+
+@pytest.mark.usefixtures('each_backend')
 class TestMask:
 
     def test_let_let_mask(self) :
@@ -366,12 +711,49 @@ class TestMask:
             composer.mask(composer.let({ 'x': -1 }, composer.mask(get_x))))))
         assert activation['response']['result'] == { 'value': 42 }
 
+@pytest.mark.usefixtures('each_backend')
 class TestRetain:
 
     def test_base_case(self) :
         activation = invoke(composer.retain('TripleAndIncrement'), { 'n': 3 })
         assert activation['response']['result'] == { 'params': { 'n': 3 }, 'result': { 'n': 10 } }
 
+    def test_claim_check(self) :
+        options = { 'claim_check': 'file:/tmp/claims', 'claim_size': 100 }
+        activation = invoke(composer.retain('TripleAndIncrement'), { 'n': 3, 'text': 'x' * 1000 }, options=options)
+        assert activation['response']['result'] == { 'params': { 'n': 3, 'text': 'x' * 1000 }, 'result': { 'n': 10 } }
+
+    def test_claim_check_suspensions(self) :
+        options = { 'claim_check': 'file:/tmp/claims', 'claim_size': 100 }
+        activation = invoke(composer.retain('TripleAndIncrement', 'DivideByTwo'), { 'n': 3, 'text': 'x' * 1000 }, options=options)
+        assert activation['response']['result'] == { 'params': { 'n': 3, 'text': 'x' * 1000 }, 'result': { 'n': 5 } }
+
+    def test_claim_check_store(self) :
+        options = { 'claim_check': TmpStore, 'claim_size': 100 }
+        activation = invoke(composer.retain('TripleAndIncrement'), { 'n': 3, 'text': 'x' * 1000 }, options=options)
+        assert activation['response']['result'] == { 'params': { 'n': 3, 'text': 'x' * 1000 }, 'result': { 'n': 10 } }
+
+    def test_claim_check_references(self) :
+        options = { 'claim_check': 'file:/tmp/claims', 'claim_size': 100 }
+        activation = invoke(composer.function(lambda env, args: args), { 'x': { '$claim': '../secret.json' } }, options=options)
+        assert activation['response']['result'] == { 'x': { '$claim': '../secret.json' } } # client input is not resolved
+        for key in ['../secret.json', '0' * 64]:
+            continuation = { 'v': 2, 'state': 0, 'stack': [], 'claims': ['x'] }
+            try:
+                invoke(composer.function(lambda env, args: args), { 'x': { '$claim': key }, '$composer': continuation }, options=options)
+                assert False
+            except Exception as err:
+                assert err.error['response']['result']['error'] == 'Claim check reference could not be resolved (see log for details)'
+
+    def test_claim_check_variables(self) :
+        options = { 'claim_check': 'file:/tmp/claims', 'claim_size': 100 }
+        store_x = composer.function(lambda env, args: env.update(x=args['x']))
+        load_x = composer.function(lambda env, args: { 'x': env['x'] })
+        activation = invoke(composer.let({ 'x': None }, store_x, 'echo', load_x), { 'x': 'x' * 1000 }, options=options)
+        assert activation['response']['result'] == { 'x': 'x' * 1000 }
+        activation = invoke(composer.let({ 'x': None }, store_x, load_x), { 'x': { '$claim': '0' * 64 } }, options=options)
+        assert activation['response']['result'] == { 'x': { '$claim': '0' * 64 } } # client input is not resolved
+
     def test_throw_error(self) :
         try:
             invoke(composer.retain(set_error), { 'n': 3 })
@@ -383,24 +765,281 @@ class TestRetain:
         activation = invoke(composer.retain_catch(set_error), { 'n': 3 })
         assert activation['response']['result'] == { 'params': { 'n': 3 }, 'result': { 'error': 'foo' } }
 
+@pytest.mark.usefixtures('each_backend')
 class TestRepeat:
 
     def test_a_few_iterations(self) :
         activation = invoke(composer.repeat(3, 'DivideByTwo'), { 'n': 8 })
         assert activation['response']['result'] == { 'n': 1 }
 
-    def test_invalid_argument(self) :
-        try:
-            invoke(composer.repeat('foo'))
-            assert False
-        except composer.ComposerError as error:
-            assert error.message.startswith('Invalid argument')
-
 def retry_test(env, args):
     x = env['x']
     env['x'] -= 1
     return { 'error': 'foo' } if x > 0 else 42
 
+@pytest.mark.usefixtures('each_backend')
+class TestMap:
+
+    def test_functions(self):
+        activation = invoke(composer.map(lambda env, args: { 'n': args['value'] * 2 }), { 'value': [1, 2, 3] })
+        assert activation['response']['result'] == { 'value': [{ 'n': 2 }, { 'n': 4 }, { 'n': 6 }] }
+
+    def test_actions(self):
+        activation = invoke(composer.map('TripleAndIncrement', 'DivideByTwo'), { 'value': [{ 'n': 1 }, { 'n': 3 }] },
+            options={ 'concurrency': 1 })
+        assert activation['response']['result'] == { 'value': [{ 'n': 2 }, { 'n': 5 }] }
+
+    def test_empty(self):
+        activation = invoke(composer.map('TripleAndIncrement'), { 'value': [] })
+        assert activation['response']['result'] == { 'value': [] }
+
+    def test_error(self):
+        try:
+            invoke(composer.map(lambda env, args: { 'error': 'odd' } if args['value'] % 2 else args), { 'value': [1, 2, 3] })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error']['errors'] == [0, 2]
+
+@pytest.mark.usefixtures('each_backend')
+class TestParallel:
+
+    def test_list(self):
+        activation = invoke(composer.parallel('TripleAndIncrement', 'DivideByTwo'), { 'n': 4 })
+        assert activation['response']['result'] == { 'value': [{ 'n': 13 }, { 'n': 2 }] }
+
+    def test_merge(self):
+        composition = composer.parallel_merge(lambda env, args: { 'a': args['n'] }, lambda env, args: { 'b': args['n'] + 1 })
+        activation = invoke(composition, { 'n': 4 })
+        assert activation['response']['result'] == { 'a': 4, 'b': 5 }
+
+    def test_error(self):
+        try:
+            invoke(composer.parallel('TripleAndIncrement', set_error), { 'n': 4 })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error']['errors'] == [1]
+
+@pytest.mark.usefixtures('each_backend')
+class TestRace:
+
+    def test_first_success(self):
+        activation = invoke(composer.race(set_error, 'TripleAndIncrement'), { 'n': 4 })
+        assert activation['response']['result'] == { 'n': 13 }
+
+    def test_winner(self):
+        activation = invoke(composer.race(set_error, 'TripleAndIncrement', winner='branch'), { 'n': 4 })
+        assert activation['response']['result'] == { 'n': 13, 'branch': 1 }
+
+    def test_concurrency(self):
+        activation = invoke(composer.race(set_error, set_error, 'TripleAndIncrement'), { 'n': 4 }, options={ 'concurrency': 1 })
+        assert activation['response']['result'] == { 'n': 13 }
+
+    def test_stagger(self):
+        activation = invoke(composer.race('DivideByTwo', 'TripleAndIncrement', stagger=5000), { 'n': 4 })
+        assert activation['response']['result'] == { 'n': 2 }
+
+    def test_abandoned(self):
+        import time
+        slow = composer.function(lambda env, args: __import__('time').sleep(5) or args)
+        begin = time.time()
+        activation = invoke(composer.seq(composer.race(slow, 'TripleAndIncrement'), composer.parallel('DivideByTwo')), { 'n': 4 },
+            options={ 'concurrency': 1 })
+        assert activation['response']['result'] == { 'value': [{ 'n': 6.5 }] }
+        assert time.time() - begin < 5
+
+    def test_error(self):
+        try:
+            invoke(composer.race(set_error, set_error), { 'n': 4 })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error']['errors'] == [0, 1]
+
+    def test_no_branches(self):
+        try:
+            invoke(composer.race(), { 'n': 4 })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error'].startswith('Race combinator has no branches')
+
+def add_activation(env, args):
+    import os
+    return { 'value': sorted(set(sum(args['value'], [os.getenv('__OW_ACTIVATION_ID')]))) }
+
+@pytest.mark.usefixtures('each_backend')
+class TestReduce:
+
+    def test_function(self):
+        activation = invoke(composer.reduce(lambda env, args: sum(args['value'])), { 'value': list(range(1, 11)) })
+        assert activation['response']['result'] == { 'value': 55 }
+
+    def test_arity(self):
+        activation = invoke(composer.reduce(lambda env, args: max(args['value']), arity=4), { 'value': [3, 9, 2, 7, 5] })
+        assert activation['response']['result'] == { 'value': 9 }
+
+    def test_activations(self):
+        # a function reducer folds every round in the activation of the conductor
+        activation = invoke(composer.reduce(add_activation), { 'value': [[]] * 8 })
+        assert len(activation['response']['result']['value']) == 1
+
+@pytest.mark.usefixtures('each_backend')
+class TestCpuMap:
+
+    def test_chunks(self):
+        activation = invoke(composer.cpu_map(lambda x: x * x, chunk=2), { 'value': [1, 2, 3, 4, 5] })
+        assert activation['response']['result'] == { 'value': [1, 4, 9, 16, 25] }
+
+    def test_exception(self):
+        try:
+            invoke(composer.cpu_map(lambda x: 1 / x, chunk=1), { 'value': [1, 0] })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error'].startswith('CPU map combinator threw an exception')
+
+def inc_calls(env, args):
+    env['calls'] += 1
+
+def inc_calls_error(env, args):
+    env['calls'] += 1
+    return { 'error': 'foo' }
+
+def get_calls(env, args):
+    return { 'calls': env['calls'] }
+
+@pytest.mark.usefixtures('each_backend')
+class TestMemo:
+
+    def test_hit(self):
+        activation = invoke(composer.let({ 'calls': 0 }, composer.repeat(3, composer.memo(inc_calls)), get_calls), { 'n': 3 })
+        assert activation['response']['result'] == { 'calls': 1 }
+
+    def test_miss(self):
+        activation = invoke(composer.let({ 'calls': 0 }, composer.repeat(3, dec_n, composer.memo(inc_calls)), get_calls), { 'n': 3 })
+        assert activation['response']['result'] == { 'calls': 3 }
+
+    def test_key(self):
+        composition = composer.let({ 'calls': 0 }, composer.repeat(3, dec_n, composer.memo(inc_calls, key=['p'])), get_calls)
+        activation = invoke(composition, { 'n': 3 })
+        assert activation['response']['result'] == { 'calls': 1 }
+
+    def test_errors(self):
+        body = composer.do(composer.memo(inc_calls_error), return_error_message)
+        activation = invoke(composer.let({ 'calls': 0 }, composer.repeat(3, body), get_calls), { 'n': 3 })
+        assert activation['response']['result'] == { 'calls': 3 }
+
+    def test_cache_errors(self):
+        body = composer.do(composer.memo(inc_calls_error, key=[], cache_errors=True), return_error_message)
+        activation = invoke(composer.let({ 'calls': 0 }, composer.repeat(3, body), get_calls), { 'n': 3 })
+        assert activation['response']['result'] == { 'calls': 1 }
+
+    def test_store(self):
+        body = composer.repeat(3, composer.memo(inc_calls))
+        activation = invoke(composer.let({ 'calls': 0 }, body, get_calls), { 'n': 3 }, options={ 'memo_store': NoStore })
+        assert activation['response']['result'] == { 'calls': 3 }
+
+@pytest.mark.usefixtures('each_backend')
+class TestBatch:
+
+    def test_not_annotated(self):
+        try:
+            invoke(composer.batch('DivideByTwo'), { 'value': [1, 2] })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error'].startswith('Batch combinator requires action')
+
+    def test_batches(self):
+        code = 'function main({ items }) { return { items: items.map(n => ({ n: 2 * n, size: items.length })) } }'
+        action = composer.action('DoubleBatch', { 'action': { 'kind': 'nodejs:default', 'code': code }, 'batch': True })
+        activation = invoke(composer.batch(action, size=2), { 'value': [1, 2, 3, 4, 5] })
+        assert activation['response']['result'] == { 'value': [{ 'n': 2, 'size': 2 }, { 'n': 4, 'size': 2 }, { 'n': 6, 'size': 2 },
+            { 'n': 8, 'size': 2 }, { 'n': 10, 'size': 1 }] }
+
+@pytest.mark.usefixtures('each_backend')
+class TestProject:
+
+    def test_nested_field(self):
+        composition = composer.project(['x.n'], composer.function(lambda env, args: { 'n': args['x']['n'], 'keys': list(args) }))
+        activation = invoke(composition, { 'x': { 'n': 3, 'm': 4 }, 'y': 5 })
+        assert activation['response']['result'] == { 'x': { 'n': 3, 'm': 4 }, 'y': 5, 'n': 3, 'keys': ['x'] }
+
+    def test_merge(self):
+        activation = invoke(composer.project(['n'], 'TripleAndIncrement'), { 'n': 3, 'm': 4 })
+        assert activation['response']['result'] == { 'n': 10, 'm': 4 }
+
+    def test_nested_merge(self):
+        increment = composer.function(lambda env, args: { 'x': { 'y': { 'n': args['x']['y']['n'] + 1 } }, 'z': {} })
+        composition = composer.project(['x.y.n', 'z'], increment)
+        activation = invoke(composition, { 'x': { 'y': { 'n': 3, 'm': 4 }, 'v': 1 }, 'z': { 'w': 2 } })
+        assert activation['response']['result'] == { 'x': { 'y': { 'n': 4, 'm': 4 }, 'v': 1 }, 'z': {} }
+
+    def test_claim_check(self):
+        options = { 'claim_check': 'file:/tmp/claims', 'claim_size': 100 }
+        activation = invoke(composer.project(['n'], 'TripleAndIncrement'), { 'n': 3, 'text': 'x' * 1000 }, options=options)
+        assert activation['response']['result'] == { 'n': 10, 'text': 'x' * 1000 }
+        composition = composer.project(['n'], composer.seq('TripleAndIncrement', 'DivideByTwo'))
+        activation = invoke(composition, { 'n': 3, 'text': 'x' * 1000 }, options=options)
+        assert activation['response']['result'] == { 'n': 5, 'text': 'x' * 1000 }
+        activation = invoke(composer.project(['n'], 'TripleAndIncrement'), { 'n': 3, 'x': { '$claim': '0' * 64 } }, options=options)
+        assert activation['response']['result'] == { 'n': 10, 'x': { '$claim': '0' * 64 } } # client input is not resolved
+
+@pytest.mark.usefixtures('each_backend')
+class TestTimeout:
+
+    def test_in_time(self):
+        activation = invoke(composer.timeout(60000, 'DivideByTwo'), { 'n': 4 })
+        assert activation['response']['result'] == { 'n': 2 }
+
+    def test_fallback(self):
+        activation = invoke(composer.timeout(100, composer.loop(cond_true, noop), set_p_4), { 'n': 4 })
+        assert activation['response']['result'] == { 'p': 4 }
+
+    def test_fallback_params(self):
+        activation = invoke(composer.timeout(100, composer.sequence(dec_n, composer.loop(cond_true, noop)), noop), { 'n': 4 })
+        assert activation['response']['result'] == { 'n': 4 }
+
+    def test_claim_check(self):
+        options = { 'claim_check': 'file:/tmp/claims', 'claim_size': 100 }
+        composition = composer.timeout(100, composer.sequence('DivideByTwo', composer.loop(cond_true, noop)), noop)
+        activation = invoke(composition, { 'n': 4, 'text': 'x' * 1000 }, options=options)
+        assert activation['response']['result'] == { 'n': 4, 'text': 'x' * 1000 }
+
+    def test_error(self):
+        try:
+            invoke(composer.timeout(100, composer.loop(cond_true, noop)), { 'n': 4 })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error'] == 'Timeout combinator expired at AST node root'
+        try:
+            invoke(composer.timeout(60000, composer.timeout(100, composer.loop(cond_true, noop))), { 'n': 4 })
+            assert False
+        except Exception as err:
+            assert err.error['response']['result']['error'] == 'Timeout combinator expired at AST node root.body'
+
+    def test_ensure(self):
+        slow = composer.function(lambda env, args: __import__('time').sleep(0.5) or args)
+        for body in [slow, composer.loop(cond_true, noop)]:
+            composition = composer.let({ 'x': 0 }, composer.timeout(100, composer.ensure(composer.ensure(body, inc_x), inc_x), noop), get_x)
+            activation = invoke(composition, { 'n': 4 })
+            assert activation['response']['result'] == { 'value': 2 }
+
+@pytest.mark.usefixtures('each_backend')
+class TestBreaker:
+
+    def test_open(self):
+        body = composer.do(composer.breaker(inc_calls_error, failures=2), return_error_message)
+        activation = invoke(composer.let({ 'calls': 0 }, composer.repeat(3, body), get_calls))
+        assert activation['response']['result'] == { 'calls': 2 }
+
+    def test_error(self):
+        body = composer.breaker(inc_calls_error, failures=1)
+        activation = invoke(composer.let({ 'calls': 0 }, composer.do(body, return_error_message), composer.do(body, return_error_message)))
+        assert activation['response']['result']['message'].startswith('Circuit breaker open')
+
+    def test_fallback(self):
+        body = composer.breaker(inc_calls_error, failures=1, fallback=set_p_4)
+        activation = invoke(composer.let({ 'calls': 0 }, composer.do(body, return_error_message), body))
+        assert activation['response']['result'] == { 'p': 4 }
+
+@pytest.mark.usefixtures('each_backend')
 class TestRetry:
 
     def test_success(self) :
@@ -413,10 +1052,3 @@ class TestRetry:
             assert False
         except Exception as err:
             assert err.error['response']['result'] == { 'error': 'foo' }
-
-    def test_invalid_argument(self) :
-        try:
-            invoke(composer.retry('foo'))
-            assert False
-        except composer.ComposerError as error:
-            assert error.message.startswith('Invalid argument')